@@ -1,14 +1,33 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, jsonify, Response, g
 import os
 import re # Nodig voor nl2br
 from markupsafe import Markup # Correcte import voor Markup
 from werkzeug.utils import secure_filename # Nodig voor veilige bestandsnamen
-import uuid # Nodig voor unieke bestandsnamen
+from werkzeug.middleware.proxy_fix import ProxyFix # Echte client-IP achter een reverse proxy
 import json
 from functools import wraps # Voor login_required decorator
-from src.models import Post, Comment, User # We halen nu modellen uit src
-from src.moderation import moderate_comment # En de moderatiefunctie
+from src.models import Post, Comment, User, COMMENT_PENDING, COMMENT_PUBLISHED # We halen nu modellen uit src
+from src.moderation import moderate_comment, moderation_cache, moderation_client # En de moderatiefunctie
+from src.moderation_prompt import select_context_comments # Begrensde context voor de moderator
+from src.moderation_queue import ModerationQueue, ModerationJob, ModerationQueueFull # Asynchrone moderatie
+from src.index import DataIndex, feed_cursor, parse_feed_cursor, username_key # O(1) opzoektabellen en feed-volgorde
+from src.storage import DuplicateUsername, ReplayState, create_storage # Pluggable opslag (json journal of sqlite)
+from src.fragment_cache import FragmentCache # Gerenderde post-kaarten
+from src.search import SearchIndex # Full-text zoeken
+from src.events import EventBroker, TooManySubscribers # Live updates via server-sent events
+from src.auth import DEFAULT_PASSWORD_METHOD, HasherBusy, PasswordHasher, TokenBucketLimiter # Wachtwoorden en rate limiting
+from src.log import log_error, log_event, log_warning # Gestructureerde logging (DIALINK_LOG_MODE)
+from src.metrics import SLOW_OPERATION_BUCKETS, registry # Prometheus metrics (/metrics)
+from src.images import CONTENT_ADDRESSED_NAME, ImagePipeline, ImageTooLarge, variant_filename # Upload-verwerking
 import datetime
+import hashlib
+import tempfile
+import threading
+import time
+try:
+    import fcntl
+except ImportError: # Windows: geen file locks; draai dan met één worker-proces
+    fcntl = None
 
 app = Flask(__name__, template_folder='templates') # Explicitly set template folder
 app.config['TEMPLATES_AUTO_RELOAD'] = True # Force template reloading
@@ -17,11 +36,16 @@ app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'een-zeer-geheime-
 # Configuratie voor uploads
 UPLOAD_FOLDER = 'static/uploads/posts'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+MAX_IMAGE_BYTES = int(os.environ.get('DIALINK_MAX_IMAGE_BYTES', 5 * 1024 * 1024))
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_IMAGE_BYTES + 64 * 1024 # Ruimte voor de overige formuliervelden
 
 # Zorg dat de upload map bestaat
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Verkleinde varianten (thumbnail, feed-breedte, WebP) worden buiten het request gemaakt
+image_pipeline = ImagePipeline(app.config['UPLOAD_FOLDER'], max_bytes=MAX_IMAGE_BYTES)
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -35,67 +59,294 @@ def nl2br(value):
 # Registreer het filter bij Jinja
 app.jinja_env.filters['nl2br'] = nl2br
 
-# --- JSON Data Handling ---
+def image_srcset(post, extension=None):
+    """srcset met de verkleinde varianten van een post-afbeelding (leeg als die er nog niet zijn)."""
+    return ', '.join(
+        f"{url_for('static', filename='uploads/posts/' + variant_filename(post.image_filename, width, extension))} {width}w"
+        for width in post.image_variants
+    )
+
+app.jinja_env.globals['image_srcset'] = image_srcset
+
+# --- Fragment cache ---
+# Post-kaarten (inhoud + comment-boom) veranderen alleen als er iets aan de post
+# gebeurt; we bewaren de gerenderde HTML per post, met een variant per login-status.
+fragment_cache = FragmentCache(max_entries=int(os.environ.get('DIALINK_FRAGMENT_CACHE_SIZE', 2000)))
+
+def cached_post(post, logged_in):
+    """Gerenderde post-kaart uit de fragment cache (zie templates/_post.html)."""
+    html = fragment_cache.get_or_render(post.id, bool(logged_in), lambda: render_template(
+        '_post.html', post=post, users=data_index.usernames, current_user=bool(logged_in)))
+    return Markup(html)
+
+app.jinja_env.globals['cached_post'] = cached_post
+
+# --- Live updates ---
+# Nieuwe posts en gemodereerde reacties gaan via server-sent events naar open
+# pagina's. Alle workers op deze machine delen een map met sockets, zodat een
+# event uit de ene worker ook de clients van de andere workers bereikt.
+SSE_HEARTBEAT_SECONDS = 15 # Houdt proxies tevreden en detecteert verbroken verbindingen
+EVENT_RELAY_DIR = os.environ.get('DIALINK_EVENT_DIR', os.path.join(
+    tempfile.gettempdir(), 'dialink-events-' + hashlib.sha1(os.getcwd().encode('utf-8')).hexdigest()[:8]))
+event_broker = EventBroker(relay_dir=EVENT_RELAY_DIR,
+                           max_clients=int(os.environ.get('DIALINK_SSE_MAX_CLIENTS', 16))) # Elke stream bezet een thread; de helft van de 32 blijft vrij
+
+# --- Zoeken ---
+# Inverted index over posts en gepubliceerde reacties, bijgewerkt bij elke
+# nieuwe post of gepubliceerde reactie en herbouwd in load_data.
+search_index = SearchIndex(max_candidates=int(os.environ.get('DIALINK_SEARCH_CANDIDATES', 2000)))
+SEARCH_RESULTS_PER_PAGE = 20
+MAX_SEARCH_PAGES = 10 # Diepere pagina's zijn zelden nuttig en kosten wel rekentijd
+
+# --- Paginering ---
+POSTS_PER_PAGE = 20
+COMMENTS_PER_PAGE = 10 # Top-level comments per post in de feed
+REPLIES_PER_PAGE = 5 # Replies per comment voordat "meer laden" verschijnt
+MAX_COMMENT_DEPTH = 3 # Diepere replies worden pas op verzoek geladen
+app.jinja_env.globals.update(
+    COMMENTS_PER_PAGE=COMMENTS_PER_PAGE,
+    REPLIES_PER_PAGE=REPLIES_PER_PAGE,
+    MAX_COMMENT_DEPTH=MAX_COMMENT_DEPTH,
+)
+
+# --- Metrics ---
+# Latency per route en de duur van laden/opslaan; wachtrijen, caches en de
+# omvang van de dataset worden bij elke scrape van /metrics uitgelezen.
+request_seconds = registry.histogram('dialink_request_seconds', 'Duur van een request per route', label='route')
+load_data_seconds = registry.histogram('dialink_load_data_seconds', 'Duur van load_data', buckets=SLOW_OPERATION_BUCKETS)
+save_data_seconds = registry.histogram('dialink_save_data_seconds', 'Duur van save_data', buckets=SLOW_OPERATION_BUCKETS)
+
+# --- Data opslag ---
+# DIALINK_STORAGE kiest de backend: 'json' (append-only journal + snapshot) of
+# 'sqlite' (gedeelde database in WAL mode, geschikt voor meerdere workers).
+STORAGE_BACKEND = os.environ.get('DIALINK_STORAGE', 'json')
 DATA_FILE = 'data.json'
+DATABASE_FILE = os.environ.get('DIALINK_DATABASE', 'data.db')
 
 # Globale variabelen voor data (worden gevuld door load_data)
 users = []
 posts = []
+data_index = DataIndex() # Opzoektabellen, bijgewerkt bij elke mutatie en vervangen in load_data
+replay_state = None # Past wijzigingen van andere workers toe op users/posts/data_index
+# Elke mutatie van users/posts/data_index én de bijbehorende storage-aanroep gebeurt
+# onder deze lock. Volgorde is altijd eerst state_lock, dan de lock van de storage.
+state_lock = threading.RLock()
+
+if STORAGE_BACKEND == 'sqlite':
+    storage = create_storage('sqlite', DATABASE_FILE)
+else:
+    # Elke mutatie wordt als één record aan het journal toegevoegd; de snapshot
+    # (data.json) wordt op de achtergrond bijgewerkt door compactie.
+    # De snapshot is binair (data.snapshot); een bestaande data.json wordt bij het laden gemigreerd.
+    storage = create_storage(STORAGE_BACKEND, DATA_FILE, compact_threshold=int(os.environ.get('DIALINK_COMPACT_THRESHOLD', 500)),
+                             snapshot_format=os.environ.get('DIALINK_SNAPSHOT_FORMAT', 'binary'))
+storage.set_state_provider(lambda: (users, posts))
+
+def apply_stored_change(op, data):
+    """Wijziging die een andere worker opsloeg; wordt door de storage aangeroepen (met state_lock)."""
+    post_id = replay_state.apply(op, data)
+    if post_id:
+        fragment_cache.bump(post_id)
+        if op == 'add_post':
+            search_index.add_post(data_index.post(post_id))
+        elif op in ('add_comment', 'update_comment'):
+            search_index.add_comment(data_index.comment(data['id'])) # Alleen gepubliceerde reacties
+
+storage.set_change_handler(apply_stored_change)
+
+def sync_with_storage():
+    """Haal de wijzigingen van andere workers binnen (alleen de delta)."""
+    if not storage.has_changes():
+        return
+    with state_lock:
+        if not storage.refresh():
+            log_warning('storage_reload', reason='behind_other_workers')
+            load_data()
 
 def load_data():
-    global users, posts
+    start = time.perf_counter()
+    with state_lock:
+        _load_data()
+    load_data_seconds.observe(time.perf_counter() - start)
+
+def _load_data():
+    global users, posts, data_index, replay_state
+    # Alles nieuw opbouwen en daarna de verwijzingen vervangen: requests die
+    # zonder state_lock lezen zien zo de oude of de nieuwe stand, nooit een
+    # half geleegde index.
     try:
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-            users = [User.from_dict(u_data) for u_data in data.get('users', [])]
-            posts = [Post.from_dict(p_data) for p_data in data.get('posts', [])]
-            print(f"Data geladen: {len(users)} gebruikers, {len(posts)} posts")
-    except FileNotFoundError:
-        print("data.json niet gevonden, start met lege lijsten.")
-        users = []
-        posts = []
+        new_users, new_posts = storage.load()
     except json.JSONDecodeError:
-        print("Fout bij het lezen van data.json, start met lege lijsten.")
-        users = []
-        posts = []
+        log_error('data_load_failed', path=DATA_FILE, error='invalid_json') # Start met lege lijsten
+        new_users, new_posts = [], []
     except Exception as e:
-        print(f"Onverwachte fout bij laden data: {e}")
-        users = []
-        posts = []
+        log_error('data_load_failed', error=str(e))
+        new_users, new_posts = [], []
+    new_index = DataIndex()
+    new_index.rebuild(new_users, new_posts)
+    search_index.rebuild(new_posts)
+    users, posts, data_index, replay_state = new_users, new_posts, new_index, ReplayState(new_users, new_posts, index=new_index)
+    fragment_cache.clear()
+    log_event('data_loaded', users=len(users), posts=len(posts), comments=len(data_index.comments_by_id))
 
 def save_data():
+    """Schrijf direct een volledige snapshot (normaal gebeurt dit op de achtergrond)."""
+    start = time.perf_counter()
     try:
-        with open(DATA_FILE, 'w') as f:
-            data_to_save = {
-                'users': [u.to_dict() for u in users],
-                'posts': [p.to_dict() for p in posts]
-            }
-            json.dump(data_to_save, f, indent=4)
-            print("Data opgeslagen naar data.json")
+        with state_lock:
+            storage.compact()
     except Exception as e:
-        print(f"Fout bij opslaan data: {e}")
+        log_error('data_save_failed', error=str(e))
+        return
+    save_data_seconds.observe(time.perf_counter() - start)
 
 # Laad data bij opstarten
 load_data()
 
 # Helper om user op ID te vinden
 def find_user_by_id(user_id):
-    return next((u for u in users if u.id == user_id), None)
+    return data_index.user(user_id)
 
-# Helper om user op username te vinden
+# Helper om user op username te vinden (hoofdletterongevoelig)
 def find_user_by_username(username):
-    return next((u for u in users if u.username.lower() == username.lower()), None)
-
-# --- Helper Function to find comments recursively ---
-def find_comment_by_id(comment_id: str, search_list: list[Comment]):
-    """Recursively search for a comment by ID within a list and its replies."""
-    for comment in search_list:
-        if comment.id == comment_id:
-            return comment
-        found_in_replies = find_comment_by_id(comment_id, comment.replies)
-        if found_in_replies:
-            return found_in_replies
-    return None
+    return data_index.user_by_username(username)
+
+# Helper om een post op ID te vinden
+def find_post_by_id(post_id):
+    return data_index.post(post_id)
+
+# --- Helper Function to find comments ---
+def find_comment_by_id(comment_id: str, post_id: str = None):
+    """Zoek een comment op ID, optioneel alleen binnen de opgegeven post."""
+    comment = data_index.comment(comment_id)
+    if comment is not None and post_id is not None and comment.post_id != post_id:
+        return None
+    return comment
+
+# --- Moderatie wachtrij ---
+def moderation_args_for(comment):
+    """Bouw de argumenten voor moderate_comment op basis van de huidige context."""
+    post = find_post_by_id(comment.post_id)
+    parent = find_comment_by_id(comment.parent_comment_id) if comment.parent_comment_id else None
+    # Context: de keten van parents plus de meest recente reacties op hetzelfde niveau
+    previous_comments = select_context_comments(post, parent, find_comment_by_id, exclude=comment)
+    return dict(
+        post_content=post.content,
+        previous_comments=previous_comments,
+        current_comment_text=comment.original_content,
+        users_dict=data_index.usernames # User id -> username (nodig voor usernames in context)
+    )
+
+def publish_moderated_comment(comment_id, moderated_text):
+    """Wordt door een moderatie-worker aangeroepen zodra de tekst klaar is."""
+    with state_lock:
+        comment = find_comment_by_id(comment_id)
+        if comment is None:
+            return
+        comment.moderated_content = moderated_text
+        comment.status = COMMENT_PUBLISHED
+        storage.update_comment(comment)
+        fragment_cache.bump(comment.post_id)
+        search_index.add_comment(comment) # Pas vindbaar als de gemodereerde tekst er is
+    event_broker.publish('comment', {
+        'id': comment.id,
+        'post_id': comment.post_id,
+        'parent_comment_id': comment.parent_comment_id, # Voor de plaatsing in de boom
+        'user_id': comment.user_id,
+        'author': data_index.usernames.get(comment.user_id, 'Anoniem'),
+        'content': comment.moderated_content,
+        'timestamp': comment.timestamp.isoformat(),
+    })
+    log_event('comment_published', comment_id=comment_id, post_id=comment.post_id, chars=len(comment.moderated_content))
+
+moderation_queue = ModerationQueue(
+    moderate=moderate_comment,
+    on_result=publish_moderated_comment,
+    worker_count=int(os.environ.get('DIALINK_MODERATION_WORKERS', 4)), # Max. gelijktijdige AI-aanroepen
+    max_pending=int(os.environ.get('DIALINK_MODERATION_QUEUE_SIZE', 200)),
+)
+
+def enqueue_moderation(comment, timeout=0.5):
+    moderation_queue.submit(ModerationJob(comment.id, moderation_args_for(comment)), timeout=timeout)
+
+# Pending reacties horen bij de wachtrij van het proces dat ze aannam. Bij het opstarten nemen we
+# alles over als er geen ander worker-proces meer leeft; anders alleen wat langer dan de lease wacht.
+MODERATION_WORKERS_FILE = (DATABASE_FILE if STORAGE_BACKEND == 'sqlite' else DATA_FILE) + '.workers'
+MODERATION_LEASE_SECONDS = float(os.environ.get('DIALINK_MODERATION_LEASE', 900))
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Bestaat, maar van een andere gebruiker
+        return True
+    return True
+
+def register_moderation_worker():
+    """Meld dit proces aan als moderatie-worker; geeft het aantal andere levende workers terug."""
+    with open(MODERATION_WORKERS_FILE, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX) # Vrijgegeven bij het sluiten
+        f.seek(0)
+        others = [pid for pid in map(int, f.read().split()) if pid != os.getpid() and _process_alive(pid)]
+        f.seek(0)
+        f.truncate()
+        f.write(' '.join(map(str, others + [os.getpid()])))
+    return len(others)
+
+def requeue_pending_comments():
+    """Plan comments opnieuw in die nog op moderatie wachten en geen levende eigenaar meer hebben."""
+    live_workers = register_moderation_worker()
+    with state_lock: # Request-threads voegen intussen comments toe
+        pending = [c for c in data_index.comments_by_id.values() if c.is_pending]
+    if live_workers:
+        cutoff = datetime.datetime.now() - datetime.timedelta(seconds=MODERATION_LEASE_SECONDS)
+        pending = [c for c in pending if c.timestamp < cutoff]
+    for comment in pending:
+        enqueue_moderation(comment, timeout=None) # Wachten op ruimte; draait in een eigen thread
+    if pending:
+        log_event('moderation_requeued', comments=len(pending), live_workers=live_workers)
+
+threading.Thread(target=requeue_pending_comments, name="moderation-requeue", daemon=True).start()
+
+# --- Wachtwoorden en rate limiting ---
+# Hashen en controleren gebeurt in een aparte process pool met een begrensde
+# rij, zodat een golf inlogpogingen het renderen van pagina's niet blokkeert.
+password_hasher = PasswordHasher(
+    workers=int(os.environ.get('DIALINK_HASH_WORKERS', 2)),
+    max_pending=int(os.environ.get('DIALINK_HASH_QUEUE_SIZE', 16)),
+    method=os.environ.get('DIALINK_PASSWORD_METHOD', DEFAULT_PASSWORD_METHOD),
+)
+login_ip_limiter = TokenBucketLimiter(per_minute=10, burst=10) # Inlogpogingen per IP
+login_user_limiter = TokenBucketLimiter(per_minute=5, burst=5) # Mislukte pogingen per gebruikersnaam en IP
+register_ip_limiter = TokenBucketLimiter(per_minute=2, burst=5) # Registraties per IP
+
+# Achter een reverse proxy (bv. Render) staat het echte client-IP in X-Forwarded-For
+PROXY_HOPS = int(os.environ.get('DIALINK_PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+def too_many_attempts(template):
+    flash('Te veel pogingen. Wacht even en probeer het dan opnieuw.', 'warning')
+    return render_template(template), 429
+
+def hasher_busy(template):
+    flash('Het is op dit moment erg druk. Probeer het zo nog eens.', 'warning')
+    return render_template(template), 503
+
+def rehash_password(user, password):
+    """Vernieuw de hash als de hash-instellingen veranderd zijn (kan alleen met het wachtwoord in de hand)."""
+    try:
+        if not password_hasher.needs_rehash(user.password_hash):
+            return
+        new_hash = password_hasher.hash(password)
+    except HasherBusy:
+        return # Volgende keer opnieuw
+    with state_lock:
+        user.password_hash = new_hash
+        storage.update_user(user)
+    password_hasher.record_rehash()
 
 # --- Decorator voor login ---
 def login_required(f):
@@ -115,16 +366,134 @@ def inject_user():
         return dict(current_user=find_user_by_id(user_id))
     return dict(current_user=None)
 
+# --- Request metrics ---
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get('request_started')
+    if started is not None:
+        # Label is de endpoint-naam (niet het pad), zodat het aantal series begrensd blijft
+        request_seconds.labels(request.endpoint or 'unmatched').observe(time.perf_counter() - started)
+    return response
+
+# --- Andere workers ---
+@app.before_request
+def sync_before_request():
+    """Verwerk eerst wat andere workers schreven, zodat elke pagina actueel is."""
+    if request.endpoint != 'static':
+        sync_with_storage()
+
+# --- Cache headers ---
+UPLOAD_CACHE_SECONDS = 365 * 24 * 3600
+
+@app.after_request
+def immutable_upload_headers(response):
+    """Afbeeldingen met een inhoudshash als naam veranderen nooit: laat browsers ze eeuwig cachen."""
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        filename = (request.view_args or {}).get('filename', '')
+        directory, _, name = filename.rpartition('/')
+        if directory == 'uploads/posts' and CONTENT_ADDRESSED_NAME.match(name):
+            response.cache_control.no_cache = None # Flask zet standaard no-cache op static bestanden
+            response.cache_control.public = True
+            response.cache_control.max_age = UPLOAD_CACHE_SECONDS
+            response.cache_control.immutable = True
+            response.expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=UPLOAD_CACHE_SECONDS)
+    return response
+
 # --- Routes ---
 
 @app.route('/')
 def index():
-    """Render de hoofdpagina met alle posts en comments."""
-    # Sorteer posts van nieuw naar oud voor weergave
-    sorted_posts = sorted(posts, key=lambda p: p.timestamp, reverse=True)
-    # Haal gebruikersnamen op voor weergave
-    users_dict = {u.id: u.username for u in users}
-    return render_template('index.html', posts=sorted_posts, users=users_dict)
+    """Render één pagina van de feed (nieuw naar oud), vanaf cursor ?before=<timestamp,id>."""
+    before = parse_feed_cursor(request.args.get('before'))
+    # Eén extra post ophalen om te weten of er nog een volgende pagina is
+    page_posts = data_index.recent_posts(before=before, limit=POSTS_PER_PAGE + 1)
+    next_cursor = None
+    if len(page_posts) > POSTS_PER_PAGE:
+        page_posts = page_posts[:POSTS_PER_PAGE]
+        next_cursor = feed_cursor(page_posts[-1])
+    # Gebruikersnamen komen uit de index (user id -> username)
+    return render_template('index.html', posts=page_posts, users=data_index.usernames, next_cursor=next_cursor)
+
+@app.route('/post/<post_id>/comments')
+def post_comments(post_id):
+    """HTML-fragment met de volgende pagina top-level comments van een post."""
+    post = find_post_by_id(post_id)
+    if post is None:
+        abort(404)
+    return render_comments_fragment(post.comments, post.id, COMMENTS_PER_PAGE,
+                                    url_for('post_comments', post_id=post.id))
+
+@app.route('/comment/<comment_id>/replies')
+def comment_replies(comment_id):
+    """HTML-fragment met de volgende pagina replies op een comment."""
+    comment = find_comment_by_id(comment_id)
+    if comment is None:
+        abort(404)
+    return render_comments_fragment(comment.replies, comment.post_id, REPLIES_PER_PAGE,
+                                    url_for('comment_replies', comment_id=comment.id))
+
+@app.route('/post/<post_id>')
+def post_fragment(post_id):
+    """HTML-fragment met één post-kaart (voor live updates)."""
+    post = find_post_by_id(post_id)
+    if post is None:
+        abort(404)
+    return cached_post(post, 'user_id' in session)
+
+@app.route('/comment/<comment_id>')
+def comment_fragment(comment_id):
+    """HTML-fragment met één comment (voor live updates)."""
+    comment = find_comment_by_id(comment_id)
+    if comment is None:
+        abort(404)
+    return render_template('comments_fragment.html', comments=[comment], offset=0, limit=1,
+                           post_id=comment.post_id, users=data_index.usernames, more_url='')
+
+@app.route('/events')
+def events():
+    """Server-sent events: nieuwe posts en gemodereerde reacties (met parent_comment_id)."""
+    try:
+        subscription = event_broker.subscribe()
+    except TooManySubscribers:
+        # 204: EventSource stopt dan zonder fout; de pagina probeert het later opnieuw (met backoff)
+        return Response(status=204)
+
+    def stream():
+        with subscription: # Afgesloten zodra de client verdwijnt (GeneratorExit)
+            yield 'retry: 5000\n\n'
+            while not subscription.closed:
+                message = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                yield message if message is not None else ': ping\n\n'
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/search')
+def search():
+    """Zoek in posts en gepubliceerde reacties (?q=..., pagina via ?page=N)."""
+    query = request.args.get('q', '').strip()[:200]
+    page = min(max(request.args.get('page', 1, type=int), 1), MAX_SEARCH_PAGES)
+    results = None
+    if query:
+        results = search_index.search(query, offset=(page - 1) * SEARCH_RESULTS_PER_PAGE,
+                                      limit=SEARCH_RESULTS_PER_PAGE)
+    hits = []
+    if results is not None:
+        # Elke treffer als (post, comment); bij een treffer in de post zelf is comment None
+        hits = [(hit, None) if isinstance(hit, Post) else (find_post_by_id(hit.post_id), hit) for hit in results.hits]
+    has_next = (results is not None and page < MAX_SEARCH_PAGES
+                and results.total > page * SEARCH_RESULTS_PER_PAGE)
+    return render_template('search.html', query=query, results=results, hits=hits, page=page,
+                           has_next=has_next, users=data_index.usernames)
+
+def render_comments_fragment(comments, post_id, limit, more_url):
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    return render_template('comments_fragment.html', comments=comments, offset=offset, limit=limit,
+                           post_id=post_id, users=data_index.usernames, more_url=more_url)
 
 @app.route('/add_post', methods=['POST'])
 @login_required # Nu beveiligd
@@ -134,34 +503,63 @@ def add_post():
     content = request.form.get('content')
     image_file = request.files.get('image') # Haal het image bestand op
 
+    if not content:
+        flash('Post inhoud mag niet leeg zijn.', 'warning')
+        return redirect(url_for('index'))
+
     image_filename_to_save = None
 
     # Verwerk de afbeelding als deze is geüpload en toegestaan is
     if image_file and image_file.filename != '' and allowed_file(image_file.filename):
-        # Genereer een veilige en unieke bestandsnaam
+        # De bestandsnaam wordt de hash van de inhoud; alleen de extensie nemen we over
         original_filename = secure_filename(image_file.filename)
         extension = original_filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{extension}"
         
         try:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            image_file.save(image_path)
-            image_filename_to_save = unique_filename # Sla alleen de bestandsnaam op
-            print(f"Afbeelding opgeslagen: {image_filename_to_save}")
+            # Gestreamd naar een tijdelijk bestand, met een limiet op de grootte
+            image_filename_to_save, is_new_image = image_pipeline.save_upload(image_file, extension)
+            log_event('image_saved', filename=image_filename_to_save, duplicate=not is_new_image)
+        except ImageTooLarge:
+            flash(f'De afbeelding is te groot (maximaal {MAX_IMAGE_BYTES // (1024 * 1024)} MB).', 'warning')
+            return redirect(url_for('index'))
         except Exception as e:
-            print(f"Fout bij opslaan afbeelding: {e}")
+            log_error('image_save_failed', error=str(e))
             # Optioneel: geef een foutmelding aan de gebruiker
 
     # Maak de post aan (met of zonder afbeelding)
-    if content:
-        new_post = Post(user_id=user_id, content=content, image_filename=image_filename_to_save)
+    new_post = Post(user_id=user_id, content=content, image_filename=image_filename_to_save)
+    if image_filename_to_save:
+        # Duplicaat van een eerdere upload: de varianten bestaan dan meestal al
+        new_post.image_variants = image_pipeline.existing_variants(image_filename_to_save)
+    with state_lock:
         posts.append(new_post)
-        save_data() # Sla data op na toevoegen post
-    else:
-         flash('Post inhoud mag niet leeg zijn.', 'warning')
+        data_index.add_post(new_post)
+        search_index.add_post(new_post)
+        storage.add_post(new_post) # Eén journal-record, geen volledige herschrijving
+    event_broker.publish('post', {
+        'id': new_post.id,
+        'user_id': new_post.user_id,
+        'author': data_index.usernames.get(new_post.user_id, 'Anoniem'),
+        'timestamp': new_post.timestamp.isoformat(),
+    })
+
+    if image_filename_to_save and not new_post.image_variants:
+        image_pipeline.schedule(image_filename_to_save, lambda widths: publish_image_variants(new_post, widths))
         
     return redirect(url_for('index'))
 
+def publish_image_variants(post, widths):
+    """Wordt door de image pipeline aangeroepen zodra de varianten klaar zijn."""
+    with state_lock:
+        post.image_variants = widths
+        storage.update_post(post)
+        fragment_cache.bump(post.id)
+
+@app.errorhandler(413)
+def request_too_large(error):
+    flash(f'De upload is te groot (maximaal {MAX_IMAGE_BYTES // (1024 * 1024)} MB).', 'warning')
+    return redirect(url_for('index'))
+
 @app.route('/add_comment/<post_id>', methods=['POST'])
 @login_required # Nu beveiligd
 def add_comment(post_id):
@@ -170,66 +568,119 @@ def add_comment(post_id):
     original_content = request.form.get('content')
     parent_comment_id = request.form.get('parent_comment_id') # Nieuw: ID van parent comment (kan leeg zijn)
 
-    target_post = next((p for p in posts if p.id == post_id), None)
+    target_post = find_post_by_id(post_id)
 
     if not (original_content and target_post):
         flash('Kon reactie niet toevoegen.', 'danger')
         return redirect(url_for('index'))
 
-    # Bepaal de context voor de moderator
     parent_comment = None
-    previous_comments_context = [] # Dit wordt de context voor de AI
     if parent_comment_id:
-        parent_comment = find_comment_by_id(parent_comment_id, target_post.comments)
-        if parent_comment:
-            # Context voor een reply: bouw de keten van replies op tot de top-level comment
-            # Simpele versie: we nemen nu alle comments onder de post als context
-            # TODO: Verfijn contextopbouw voor diepe replies indien nodig
-            previous_comments_context = target_post.comments
-        else:
+        parent_comment = find_comment_by_id(parent_comment_id, post_id)
+        if not parent_comment:
             # Parent ID gegeven maar niet gevonden? Fout -> terug naar index
-            print(f"Fout: Parent comment {parent_comment_id} niet gevonden.")
+            log_warning('parent_comment_missing', post_id=post_id, parent_comment_id=parent_comment_id)
             flash('Kon niet reageren op de geselecteerde comment.', 'danger')
             return redirect(url_for('index'))
-    else:
-        # Top-level comment: context zijn alle bestaande top-level comments
-        previous_comments_context = target_post.comments
-
-    # Modereer de comment met context
-    print(f"Originele reactie ontvangen voor post {post_id} (parent: {parent_comment_id}): {original_content}")
-    print("Reactie wordt gemodereerd met context...")
-    
-    # Haal de user dictionary op (nodig voor usernames in context)
-    users_dict = {u.id: u.username for u in users}
-    
-    moderated_content = moderate_comment(
-        post_content=target_post.content,
-        previous_comments=previous_comments_context,
-        current_comment_text=original_content,
-        users_dict=users_dict # Geef users_dict door
-    )
-    print(f"Gemodereerde reactie: {moderated_content}")
 
-    # Maak de nieuwe comment
+    # Back-pressure: als de moderatie-wachtrij vol zit, nemen we niets meer aan
+    if moderation_queue.full():
+        flash('Het is op dit moment erg druk. Probeer je reactie zo nog eens te plaatsen.', 'warning')
+        return redirect(url_for('index'))
+
+    # Maak de nieuwe comment; de moderator werkt hem op de achtergrond bij
     new_comment = Comment(
         user_id=user_id,
-        content=moderated_content,
+        content=original_content,
         post_id=post_id,
         original_content=original_content,
-        parent_comment_id=parent_comment_id if parent_comment else None
+        parent_comment_id=parent_comment_id if parent_comment else None,
+        status=COMMENT_PENDING
     )
 
-    # Voeg de comment toe op de juiste plaats
-    if parent_comment:
-        parent_comment.add_reply(new_comment)
-    else:
-        # Voeg top-level comment toe aan de post lijst
-        target_post.comments.append(new_comment)
+    with state_lock:
+        # Voeg de comment toe op de juiste plaats
+        if parent_comment:
+            parent_comment.add_reply(new_comment)
+        else:
+            # Voeg top-level comment toe aan de post lijst
+            target_post.add_comment(new_comment)
+        data_index.add_comment(new_comment)
+        fragment_cache.bump(post_id) # Gerenderde kaart van deze post is niet meer actueel
 
-    save_data() # Sla data op na toevoegen comment
+        storage.add_comment(new_comment) # Eén journal-record voor de nieuwe comment
+
+    log_event('comment_received', comment_id=new_comment.id, post_id=post_id, parent_comment_id=parent_comment_id,
+              chars=len(original_content)) # Nooit de tekst zelf loggen
+    try:
+        enqueue_moderation(new_comment)
+    except ModerationQueueFull:
+        # Blijft 'pending' in de opslag en wordt bij een herstart opnieuw ingepland
+        log_warning('moderation_queue_full', comment_id=new_comment.id)
+    flash('Je reactie wordt gemodereerd en verschijnt zo.', 'info')
 
     return redirect(url_for('index'))
 
+@app.route('/moderation/stats')
+def moderation_stats():
+    """Wachtrij-diepte, cache-, client- en breaker-statistieken van de moderatie (JSON)."""
+    auth = dict(hasher=password_hasher.stats(), login_ip=login_ip_limiter.stats(),
+                login_user=login_user_limiter.stats(), register_ip=register_ip_limiter.stats())
+    return jsonify(queue=moderation_queue.stats(), cache=moderation_cache.stats(), client=moderation_client.stats(),
+                   fragments=fragment_cache.stats(), events=event_broker.stats(), auth=auth)
+
+@app.route('/metrics')
+def metrics():
+    """Metrics van deze worker in het Prometheus tekstformaat."""
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Wachtrijen, caches en de omvang van de dataset worden per scrape uitgelezen
+# Totalen die alleen oplopen zijn counters (`_total`), de rest gauges
+registry.register_stats('dialink_dataset', lambda: {
+    'users': len(users), 'posts': len(posts), 'comments': len(data_index.comments_by_id)}, {
+    'users': ('gauge', 'Gebruikers in het geheugen'),
+    'posts': ('gauge', 'Posts in het geheugen'),
+    'comments': ('gauge', 'Reacties in het geheugen'),
+})
+registry.register_stats('dialink_moderation_queue', moderation_queue.stats, {
+    'pending': ('gauge', 'Reacties die op een moderatie-worker wachten'),
+    'in_flight': ('gauge', 'Reacties die nu gemodereerd worden'),
+    'max_pending': ('gauge', 'Maximale lengte van de moderatie-wachtrij'),
+    'workers': ('gauge', 'Moderatie-workers'),
+    'processed': ('counter', 'Gemodereerde reacties'),
+    'failed': ('counter', 'Moderaties die mislukten'),
+    'rejected': ('counter', 'Reacties geweigerd door een volle wachtrij'),
+    'avg_wait_seconds': ('gauge', 'Gemiddelde wachttijd in de rij sinds de start'),
+})
+registry.register_stats('dialink_fragment_cache', fragment_cache.stats, {
+    'entries': ('gauge', 'Gerenderde post-kaarten in de cache'),
+    'hits': ('counter', 'Post-kaarten uit de cache'),
+    'misses': ('counter', 'Post-kaarten die gerenderd moesten worden'),
+})
+registry.register_stats('dialink_events', event_broker.stats, {
+    'clients': ('gauge', 'Open SSE-verbindingen'),
+    'max_clients': ('gauge', 'Maximum aantal SSE-verbindingen per worker'),
+    'published': ('counter', 'Verstuurde events'),
+    'slow_clients_dropped': ('counter', 'Verbroken trage SSE-verbindingen'),
+    'relay_sent': ('counter', 'Events doorgegeven aan andere workers'),
+    'relay_received': ('counter', 'Events ontvangen van andere workers'),
+    'relay_dropped': ('counter', 'Events die niet doorgegeven konden worden'),
+})
+registry.register_stats('dialink_search', search_index.stats, {
+    'documents': ('gauge', 'Documenten in de zoekindex'),
+    'replaced': ('gauge', 'Vervangen documenten die nog in de index staan'),
+    'terms': ('gauge', 'Unieke termen in de zoekindex'),
+    'queries': ('counter', 'Zoekopdrachten'),
+})
+registry.register_stats('dialink_password_hasher', password_hasher.stats, {
+    'workers': ('gauge', 'Processen voor wachtwoord-hashing'),
+    'pending': ('gauge', 'Hash-opdrachten in de rij'),
+    'max_pending': ('gauge', 'Maximale lengte van de hash-rij'),
+    'completed': ('counter', 'Uitgevoerde hash-opdrachten'),
+    'rejected': ('counter', 'Hash-opdrachten geweigerd door een volle rij'),
+    'rehashed': ('counter', 'Hashes vernieuwd bij het inloggen'),
+})
+
 # --- Authenticatie Routes ---
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -238,6 +689,9 @@ def register():
         return redirect(url_for('index'))
         
     if request.method == 'POST':
+        if not register_ip_limiter.try_acquire(request.remote_addr):
+            return too_many_attempts('register.html')
+
         username = request.form.get('username')
         password = request.form.get('password')
         
@@ -245,15 +699,30 @@ def register():
             flash('Gebruikersnaam en wachtwoord zijn verplicht.', 'danger')
             return redirect(url_for('register'))
 
-        # Check of gebruikersnaam al bestaat
+        # Snelle check vóór het (dure) hashen; de echte check volgt hieronder onder lock
         if find_user_by_username(username):
             flash('Gebruikersnaam bestaat al.', 'warning')
             return redirect(url_for('register'))
 
-        # Nieuwe gebruiker aanmaken en opslaan
-        new_user = User(username=username, password=password)
-        users.append(new_user)
-        save_data() # Sla nieuwe gebruiker op
+        # Nieuwe gebruiker aanmaken (het hashen gebeurt in de process pool, buiten de locks)
+        try:
+            new_user = User(username=username, password_hash=password_hasher.hash(password))
+        except HasherBusy:
+            return hasher_busy('register.html')
+
+        # Check en opslaan als één stap: geen andere worker kan er tussendoor dezelfde naam registreren
+        with state_lock, storage.exclusive():
+            sync_with_storage()
+            if find_user_by_username(username):
+                flash('Gebruikersnaam bestaat al.', 'warning')
+                return redirect(url_for('register'))
+            try:
+                storage.add_user(new_user) # Sla nieuwe gebruiker op in het journal
+            except DuplicateUsername:
+                flash('Gebruikersnaam bestaat al.', 'warning')
+                return redirect(url_for('register'))
+            users.append(new_user)
+            data_index.add_user(new_user)
         
         flash('Registratie succesvol! Je kunt nu inloggen.', 'success')
         return redirect(url_for('login'))
@@ -266,16 +735,31 @@ def login():
         return redirect(url_for('index'))
         
     if request.method == 'POST':
-        username = request.form.get('username')
-        password = request.form.get('password')
+        if not login_ip_limiter.try_acquire(request.remote_addr):
+            return too_many_attempts('login.html')
+
+        username = request.form.get('username') or ''
+        password = request.form.get('password') or ''
+        # Mislukte pogingen tellen per (gebruikersnaam, IP): raden vanaf een ander adres
+        # sluit de echte gebruiker niet buiten
+        attempt_key = (username_key(username), request.remote_addr)
+        if not login_user_limiter.available(attempt_key):
+            return too_many_attempts('login.html')
         
         user = find_user_by_username(username)
         
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and password_hasher.verify(user.password_hash, password)
+        except HasherBusy:
+            return hasher_busy('login.html')
+
+        if valid:
+            rehash_password(user, password) # Oude hash-instellingen? Dan nu vernieuwen
             session['user_id'] = user.id # Sla user ID op in sessie
             flash(f'Welkom terug, {user.username}!', 'success')
             return redirect(url_for('index'))
         else:
+            login_user_limiter.try_acquire(attempt_key)
             flash('Ongeldige gebruikersnaam of wachtwoord.', 'danger')
             return redirect(url_for('login'))
             
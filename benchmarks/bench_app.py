@@ -0,0 +1,346 @@
+"""End-to-end benchmark van de Flask-app op synthetische datasets.
+
+Gebruik (vanuit de hoofdmap van het project):
+
+    python -m benchmarks.bench_app --scales small medium
+    python -m benchmarks.bench_app --scales large --storage sqlite --output resultaten.json
+
+Per schaal wordt een dataset gezaaid (gebruikers, posts en comment-bomen met
+diepe reply-ketens) in een tijdelijke map. Daarna importeert een apart proces
+de app op die data en meet:
+
+    load/save   duur van load_data en save_data, geheugen na het laden
+    index       render-latency van de feed, koud en warm, anoniem en ingelogd
+    add_comment requests per seconde en tijd tot alles gepubliceerd is, met een
+                gestubde moderate_comment (geen model, geen netwerk)
+    login       geslaagde logins per seconde via de process pool
+
+Elke schaal draait in een vers proces. De resultaten (met commit en
+Python-versie) gaan als JSON naar stdout en optioneel naar --output, zodat
+commits met elkaar vergeleken kunnen worden.
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+from werkzeug.security import generate_password_hash
+
+from src import log
+from src.models import User, Post, Comment
+from src.storage import create_storage
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCALES = {
+    'small': {'users': 1000, 'posts': 200, 'comments': 10000},
+    'medium': {'users': 10000, 'posts': 2000, 'comments': 100000},
+    'large': {'users': 50000, 'posts': 10000, 'comments': 1000000},
+}
+BENCH_USERNAME = 'benchmark'
+BENCH_PASSWORD = 'benchmark-wachtwoord'
+DATA_FILES = {'json': 'data.json', 'sqlite': 'data.db'} # Zoals app.py ze verwacht
+
+
+# --- Dataset zaaien ---
+
+def seed_dataset(users: int, posts: int, comments: int, max_depth: int, seed: int = 42):
+    """Maak een reproduceerbare dataset: (users, posts).
+
+    Eén op de tien posts krijgt een reply-keten tot `max_depth` diep; in de
+    andere posts is ongeveer de helft van de reacties een reply op een
+    willekeurige eerdere reactie in dezelfde post.
+    """
+    rng = random.Random(seed)
+    shared_hash = generate_password_hash('x') # Eén keer hashen; alleen BENCH_USERNAME logt echt in
+    seeded_users = [User(BENCH_USERNAME, password_hash=generate_password_hash(BENCH_PASSWORD))]
+    for i in range(users - 1):
+        seeded_users.append(User(f'gebruiker{i}', password_hash=shared_hash))
+    for user in seeded_users:
+        user.id = str(uuid.UUID(int=rng.getrandbits(128)))
+    user_ids = [user.id for user in seeded_users]
+
+    start = datetime.datetime(2024, 1, 1)
+    per_post = max(1, comments // posts)
+    seeded_posts = []
+    remaining = comments
+    for p in range(posts):
+        post = Post(user_id=rng.choice(user_ids), content=f"Post {p}: wat vinden jullie hiervan? {rng.getrandbits(24)}")
+        post.id = str(uuid.UUID(int=rng.getrandbits(128)))
+        post.timestamp = start + datetime.timedelta(minutes=p)
+        deep = p % 10 == 0
+        flat = []
+        count = remaining if p == posts - 1 else min(per_post, remaining)
+        for i in range(count):
+            text = f"Reactie {i} op post {p}, met een gemiddelde lengte zodat de tekst realistisch is {rng.getrandbits(32)}."
+            comment = Comment(user_id=rng.choice(user_ids), content=text, post_id=post.id)
+            comment.id = str(uuid.UUID(int=rng.getrandbits(128)))
+            comment.timestamp = post.timestamp + datetime.timedelta(seconds=i + 1)
+            if rng.random() < 0.2:
+                comment.moderated_content = text + " Wat bedoel je precies?"
+            if deep and flat and len(flat) < max_depth:
+                parent = flat[-1] # Keten: elke reactie antwoordt op de vorige
+            elif flat and rng.random() < 0.5:
+                parent = rng.choice(flat)
+            else:
+                parent = None
+            if parent is not None:
+                parent.add_reply(comment)
+            else:
+                post.add_comment(comment)
+            flat.append(comment)
+        remaining -= count
+        seeded_posts.append(post)
+    return seeded_users, seeded_posts
+
+
+def write_dataset(storage_backend: str, data_dir: str, users, posts):
+    storage = create_storage(storage_backend, os.path.join(data_dir, DATA_FILES[storage_backend]))
+    storage.import_data(users, posts)
+
+
+# --- Metingen (in het kindproces, met de app geïmporteerd) ---
+
+def percentiles(timings_ms):
+    timings_ms = sorted(timings_ms)
+    if not timings_ms:
+        return {}
+    pick = lambda q: timings_ms[min(len(timings_ms) - 1, int(len(timings_ms) * q))]
+    return {'p50_ms': round(statistics.median(timings_ms), 2), 'p95_ms': round(pick(0.95), 2),
+            'p99_ms': round(pick(0.99), 2)}
+
+
+def timed(fn, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def measure_load_save(A, repeat: int, memory: bool):
+    load = timed(A.load_data, repeat)
+    result = {'load_s_min': round(min(load), 3), 'load_s_median': round(statistics.median(load), 3)}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        A.load_data()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result.update(load_retained_mb=round(retained / 1e6, 1), load_peak_mb=round(peak / 1e6, 1))
+    save = timed(A.save_data, repeat)
+    result.update(save_s_min=round(min(save), 3), save_s_median=round(statistics.median(save), 3))
+    return result
+
+
+def logged_in_client(A, user):
+    client = A.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user.id # Zonder wachtwoord: login meten we apart
+    return client
+
+
+def measure_index(A, user, requests: int):
+    result = {}
+    for label, client in (('anonymous', A.app.test_client()), ('logged_in', logged_in_client(A, user))):
+        A.fragment_cache.clear()
+        start = time.perf_counter()
+        status = client.get('/').status_code
+        cold_ms = (time.perf_counter() - start) * 1000
+        warm = [t * 1000 for t in timed(lambda: client.get('/'), requests)]
+        result[label] = dict(status=status, cold_ms=round(cold_ms, 2), **percentiles(warm))
+    return result
+
+
+def run_threads(thread_count: int, work):
+    """Draai work(thread_index) in thread_count threads; geeft de verstreken tijd."""
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(thread_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def measure_add_comment(A, users, total: int, thread_count: int, seed: int):
+    # Gestubde moderatie: de tekst komt ongewijzigd terug, zonder model of cache
+    A.moderation_queue.moderate = lambda **kwargs: kwargs['current_comment_text']
+    rng = random.Random(seed)
+    post_ids = list(A.data_index.posts_by_id)
+    comment_ids = list(A.data_index.comments_by_id)
+    targets = []
+    for _ in range(total):
+        if rng.random() < 0.5:
+            parent = A.data_index.comment(rng.choice(comment_ids))
+            targets.append((parent.post_id, parent.id))
+        else:
+            targets.append((rng.choice(post_ids), ''))
+    before = len(A.data_index.comments_by_id)
+    timings = []
+    lock = threading.Lock()
+
+    def work(index):
+        client = logged_in_client(A, users[index % len(users)])
+        own = []
+        for post_id, parent_id in targets[index::thread_count]:
+            start = time.perf_counter()
+            client.post(f'/add_comment/{post_id}', data={'content': 'Benchmarkreactie met wat tekst erin.',
+                                                         'parent_comment_id': parent_id})
+            own.append((time.perf_counter() - start) * 1000)
+        with lock:
+            timings.extend(own)
+
+    start = time.perf_counter()
+    elapsed = run_threads(thread_count, work)
+    accepted = len(A.data_index.comments_by_id) - before
+    while True: # Wachten tot de moderatie-workers alles gepubliceerd hebben
+        stats = A.moderation_queue.stats()
+        if stats['pending'] == 0 and stats['in_flight'] == 0:
+            break
+        time.sleep(0.01)
+    published_s = time.perf_counter() - start
+    return dict(requests=total, accepted=accepted, threads=thread_count,
+                requests_per_s=round(total / elapsed, 1), published_per_s=round(accepted / published_s, 1),
+                **percentiles(timings))
+
+
+def measure_login(A, total: int, thread_count: int):
+    outcomes = {}
+    lock = threading.Lock()
+
+    def work(index):
+        for i in range(index, total, thread_count):
+            client = A.app.test_client() # Nieuwe sessie per login
+            status = client.post('/login', data={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD},
+                                 environ_base={'REMOTE_ADDR': f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'}
+                                 ).status_code # Eigen IP per login: de rate limiter meten we niet
+            with lock:
+                outcomes[status] = outcomes.get(status, 0) + 1
+
+    elapsed = run_threads(thread_count, work)
+    ok = outcomes.get(302, 0)
+    return dict(requests=total, threads=thread_count, ok=ok, busy=outcomes.get(503, 0),
+                logins_per_s=round(ok / elapsed, 1), hash_workers=A.password_hasher.workers)
+
+
+def run_scale(args):
+    """Kindproces: importeer de app op de gezaaide data en meet."""
+    os.chdir(args.data_dir)
+    os.environ.update(
+        DIALINK_STORAGE=args.storage,
+        DIALINK_DATABASE=DATA_FILES['sqlite'],
+        DIALINK_MODERATION_BACKEND='fake',
+        DIALINK_LOG_MODE='quiet',
+        DIALINK_EVENT_DIR=os.path.join(args.data_dir, 'events'),
+        DIALINK_COMPACT_THRESHOLD=str(10 ** 9), # Geen compactie op de achtergrond tijdens het meten
+    )
+    sys.path.insert(0, REPO_ROOT)
+    start = time.perf_counter()
+    import app as A
+    import_s = time.perf_counter() - start
+    user = A.find_user_by_username(BENCH_USERNAME)
+
+    result = {'benchmark': 'app', 'scale': args.run_scale, 'storage': args.storage, **SCALES[args.run_scale],
+              'import_s': round(import_s, 3)}
+    result['load_save'] = measure_load_save(A, args.repeat, not args.no_memory)
+    result['index'] = measure_index(A, user, args.index_requests)
+    result['add_comment'] = measure_add_comment(A, A.users[:100], args.comments_requests, args.threads, args.seed)
+    result['login'] = measure_login(A, args.logins, args.threads)
+    with open(os.path.join(args.data_dir, 'result.json'), 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+# --- Hoofdproces ---
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(result):
+    load = result['load_save']
+    print(f"[{result['scale']}] {result['users']:,} gebruikers, {result['posts']:,} posts, "
+          f"{result['comments']:,} comments ({result['storage']})")
+    print(f"  load_data {load['load_s_median']} s, save_data {load['save_s_median']} s"
+          + (f", geheugen {load['load_retained_mb']} MB (piek {load['load_peak_mb']} MB)" if 'load_retained_mb' in load else ""))
+    for label, index in result['index'].items():
+        print(f"  index ({label}): koud {index['cold_ms']} ms, warm p50 {index['p50_ms']} ms, p99 {index['p99_ms']} ms")
+    comments = result['add_comment']
+    print(f"  add_comment: {comments['requests_per_s']} req/s, {comments['published_per_s']} gepubliceerd/s, "
+          f"p99 {comments['p99_ms']} ms ({comments['accepted']}/{comments['requests']} geaccepteerd)")
+    login = result['login']
+    print(f"  login: {login['logins_per_s']} per seconde ({login['ok']} ok, {login['busy']} bezet, "
+          f"{login['hash_workers']} hash-workers)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark van de app op synthetische datasets.")
+    parser.add_argument('--scales', nargs='+', choices=sorted(SCALES), default=['small', 'medium'])
+    parser.add_argument('--storage', choices=sorted(DATA_FILES), default='json')
+    parser.add_argument('--max-depth', type=int, default=100, help="Diepte van de reply-ketens")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3, help="Herhalingen van load_data en save_data")
+    parser.add_argument('--index-requests', type=int, default=200)
+    parser.add_argument('--comments-requests', type=int, default=2000)
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--no-memory', action='store_true', help="Sla de (trage) geheugenmeting over")
+    parser.add_argument('--output', help="Schrijf de resultaten ook als JSON naar dit bestand")
+    parser.add_argument('--run-scale', help=argparse.SUPPRESS) # Intern: kindproces voor één schaal
+    parser.add_argument('--data-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        run_scale(args)
+        return
+
+    log.configure('quiet') # Alleen de meetresultaten op stdout
+    results = []
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as data_dir:
+            start = time.perf_counter()
+            users, posts = seed_dataset(**SCALES[scale], max_depth=args.max_depth, seed=args.seed)
+            write_dataset(args.storage, data_dir, users, posts)
+            del users, posts
+            gc.collect()
+            seed_s = time.perf_counter() - start
+
+            child_args = [sys.executable, '-m', 'benchmarks.bench_app', '--run-scale', scale, '--data-dir', data_dir]
+            for name in ('storage', 'seed', 'repeat', 'index_requests', 'comments_requests', 'logins', 'threads'):
+                child_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+            if args.no_memory:
+                child_args.append('--no-memory')
+            # Resultaat via een bestand: stdout van het kindproces blijft vrij voor logregels van de app
+            if subprocess.run(child_args, cwd=REPO_ROOT, stdout=subprocess.DEVNULL).returncode != 0:
+                raise SystemExit(f"Benchmark voor schaal {scale} is mislukt")
+            with open(os.path.join(data_dir, 'result.json'), encoding='utf-8') as f:
+                result = json.load(f)
+            result['seed_s'] = round(seed_s, 1)
+            results.append(result)
+            report(result)
+
+    output = {'commit': git_commit(), 'python': platform.python_version(), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+    print(json.dumps(output))
+
+
+if __name__ == "__main__":
+    main()
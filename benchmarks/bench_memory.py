@@ -0,0 +1,128 @@
+"""Geheugenbenchmark: hoeveel bytes kost één comment in het geheugen?
+
+Gebruik (vanuit de hoofdmap van het project):
+
+    python -m benchmarks.bench_memory --comments 1000000
+
+Bouwt een synthetische dataset op zoals die uit data.json komt (JSON per post,
+met geneste replies) en hydrateert die twee keer: met een kopie van de oude,
+dict-gebaseerde modellen en met de huidige compacte modellen. Gemeten wordt
+het geheugen dat na het laden in gebruik blijft (tracemalloc).
+"""
+import argparse
+import datetime
+import gc
+import json
+import random
+import time
+import tracemalloc
+import uuid
+
+from src.models import Post
+
+
+class LegacyComment:
+    """De Comment zoals die was vóór __slots__ en gedeelde id's (alleen voor de vergelijking)."""
+
+    @staticmethod
+    def from_dict(data):
+        comment = LegacyComment.__new__(LegacyComment)
+        comment.id = data['id']
+        comment.post_id = data['post_id']
+        comment.parent_comment_id = data.get('parent_comment_id')
+        comment.user_id = data['user_id']
+        comment.original_content = data['original_content']
+        comment.moderated_content = data['moderated_content']
+        comment.timestamp = datetime.datetime.fromisoformat(data['timestamp'])
+        comment.status = data.get('status', 'published')
+        comment.replies = [LegacyComment.from_dict(r_data) for r_data in data.get('replies', [])]
+        return comment
+
+
+class LegacyPost:
+    @staticmethod
+    def from_dict(data):
+        post = LegacyPost.__new__(LegacyPost)
+        post.id = data['id']
+        post.user_id = data['user_id']
+        post.content = data['content']
+        post.image_filename = data.get('image_filename')
+        post.image_variants = data.get('image_variants', [])
+        post.timestamp = datetime.datetime.fromisoformat(data['timestamp'])
+        post.comments = [LegacyComment.from_dict(c_data) for c_data in data.get('comments', [])]
+        return post
+
+
+def generate_posts(comment_count: int, comments_per_post: int, rewritten_share: float, seed: int = 42):
+    """Geef per post de JSON-tekst, zoals een snapshot die zou bevatten.
+
+    Ongeveer de helft van de comments is een reply op een eerdere comment in
+    dezelfde post; `rewritten_share` bepaalt welk deel de moderator herschreef.
+    """
+    rng = random.Random(seed)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(1000)]
+    start = datetime.datetime(2024, 1, 1)
+    remaining = comment_count
+    while remaining > 0:
+        post_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        top_level = []
+        flat = []
+        for i in range(min(comments_per_post, remaining)):
+            text = f"Reactie {i} met een gemiddelde lengte, zodat de tekst realistisch is {rng.getrandbits(32)}."
+            parent = rng.choice(flat) if flat and rng.random() < 0.5 else None
+            comment = {
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'post_id': post_id,
+                'parent_comment_id': parent['id'] if parent else None,
+                'user_id': rng.choice(user_ids),
+                'original_content': text,
+                'moderated_content': text + " Wat bedoel je precies?" if rng.random() < rewritten_share else text,
+                'timestamp': (start + datetime.timedelta(seconds=len(flat))).isoformat(),
+                'status': 'published',
+                'replies': [],
+            }
+            (parent['replies'] if parent else top_level).append(comment)
+            flat.append(comment)
+        remaining -= len(flat)
+        yield json.dumps({'id': post_id, 'user_id': rng.choice(user_ids), 'content': 'Een post.',
+                          'image_filename': None, 'image_variants': [],
+                          'timestamp': start.isoformat(), 'comments': top_level})
+
+
+def measure(post_class, post_texts):
+    """Laad alle posts en geef (bytes in gebruik na het laden, seconden)."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    posts = [post_class.from_dict(json.loads(text)) for text in post_texts]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del posts
+    return retained, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Meet het geheugengebruik per comment.")
+    parser.add_argument('--comments', type=int, default=1000000, help="Totaal aantal comments")
+    parser.add_argument('--comments-per-post', type=int, default=100)
+    parser.add_argument('--rewritten-share', type=float, default=0.2,
+                        help="Deel van de comments dat de moderator herschreef (0-1)")
+    args = parser.parse_args()
+
+    post_texts = list(generate_posts(args.comments, args.comments_per_post, args.rewritten_share))
+    results = []
+    for label, post_class in (('legacy', LegacyPost), ('compact', Post)):
+        retained, elapsed = measure(post_class, post_texts)
+        per_comment = retained / args.comments
+        results.append({'benchmark': 'memory_per_comment', 'model': label, 'comments': args.comments,
+                        'bytes_per_comment': round(per_comment), 'total_mb': round(retained / 1e6, 1),
+                        'load_s': round(elapsed, 2)})
+        print(f"{label:>8}: {per_comment:,.0f} bytes per comment, {retained / 1e6:,.1f} MB totaal, laden {elapsed:.2f} s")
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
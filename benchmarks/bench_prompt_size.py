@@ -0,0 +1,66 @@
+"""Prompt-grootte benchmark: blijft de moderatie-prompt constant bij groeiende threads?
+
+Gebruik (vanuit de hoofdmap van het project):
+
+    python -m benchmarks.bench_prompt_size
+
+Bouwt per grootte een post met N top-level reacties en een reply-keten van
+diepte N, en meet de lengte en bouwtijd van de prompt voor een nieuwe reply
+onderaan de keten. De nummers in de reacties hebben een vaste breedte, dus
+zodra de caps bereikt zijn (keten dieper dan MAX_ANCESTORS) moet de prompt
+bij de grootste thread exact even lang zijn als bij de kleinste; anders
+stopt de benchmark met een fout.
+"""
+import argparse
+import json
+import time
+
+from src.models import Post, Comment
+from src.moderation_prompt import build_history, build_prompt, select_context_comments
+
+
+def build_thread(size: int, width: int):
+    post = Post(user_id='auteur', content='Wat vinden jullie van het nieuwe fietspad?')
+    comments_by_id = {}
+    for i in range(size):
+        comment = Comment(user_id=f'user{i % 50}', content=f'Top-level reactie nummer {i:0{width}d}.', post_id=post.id)
+        post.add_comment(comment)
+        comments_by_id[comment.id] = comment
+    parent = post.comments[0]
+    for i in range(size):
+        reply = Comment(user_id=f'user{i % 50}', content=f'Antwoord {i:0{width}d} in de keten.', post_id=post.id,
+                        parent_comment_id=parent.id)
+        parent.add_reply(reply)
+        comments_by_id[reply.id] = reply
+        parent = reply
+    return post, parent, comments_by_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Meet de prompt-grootte bij groeiende threads.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    users_dict = {f'user{i}': f'gebruiker{i}' for i in range(50)}
+    width = len(str(max(args.sizes)))
+    results = []
+    for size in sorted(args.sizes):
+        post, deepest, comments_by_id = build_thread(size, width)
+        start = time.perf_counter()
+        context = select_context_comments(post, deepest, comments_by_id.get)
+        history = build_history(post.content, context, users_dict)
+        prompt = build_prompt(history, 'Ik ben het hier totaal niet mee eens!')
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        results.append({'benchmark': 'prompt_size', 'thread_size': size, 'prompt_chars': len(prompt),
+                        'build_ms': round(elapsed_ms, 3)})
+        print(f"thread van {size:>6} reacties + keten van {size:>6}: prompt {len(prompt)} tekens, {elapsed_ms:.3f} ms")
+
+    print(json.dumps(results))
+    smallest, largest = results[0], results[-1]
+    if largest['prompt_chars'] != smallest['prompt_chars']:
+        raise SystemExit(f"Prompt groeit met de thread: {smallest['prompt_chars']} tekens bij {smallest['thread_size']}, "
+                         f"{largest['prompt_chars']} bij {largest['thread_size']} reacties")
+
+
+if __name__ == "__main__":
+    main()
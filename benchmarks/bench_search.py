@@ -0,0 +1,74 @@
+"""Zoekbenchmark: opbouwtijd en query-latency van de inverted index.
+
+Gebruik (vanuit de hoofdmap van het project):
+
+    python -m benchmarks.bench_search --comments 1000000
+
+Bouwt de zoekindex over dezelfde synthetische dataset als bench_memory en
+meet de rebuild-tijd (zoals in load_data) en de latency per zoekopdracht:
+een zeer algemene term, een combinatie van algemene termen, een term die in
+ongeveer 20% van de reacties staat en een term die in één reactie staat.
+Met --memory wordt ook het geheugen van de index gemeten (tracemalloc, traag).
+"""
+import argparse
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+
+from benchmarks.bench_memory import generate_posts
+from src.models import Post
+from src.search import SearchIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Meet opbouwtijd en query-latency van de zoekindex.")
+    parser.add_argument('--comments', type=int, default=1000000, help="Totaal aantal comments")
+    parser.add_argument('--comments-per-post', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50, help="Herhalingen per zoekopdracht")
+    parser.add_argument('--memory', action='store_true', help="Meet ook het geheugen van de index (traag)")
+    args = parser.parse_args()
+
+    posts = [Post.from_dict(json.loads(text)) for text in generate_posts(args.comments, args.comments_per_post, 0.2)]
+    rare_term = posts[-1].comments[0].original_content.split()[-1].rstrip('.') # Willekeurig getal, komt één keer voor
+
+    index = SearchIndex()
+    gc.collect()
+    if args.memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    index.rebuild(posts)
+    rebuild_seconds = time.perf_counter() - start
+    index_mb = None
+    if args.memory:
+        index_mb = round(tracemalloc.get_traced_memory()[0] / 1e6, 1)
+        tracemalloc.stop()
+    stats = index.stats()
+    print(f"rebuild: {rebuild_seconds:.2f} s voor {stats['documents']:,} documenten, {stats['terms']:,} termen"
+          + (f", {index_mb} MB" if index_mb is not None else ""))
+    results = [{'benchmark': 'search_rebuild', 'comments': args.comments, 'documents': stats['documents'],
+                'terms': stats['terms'], 'rebuild_s': round(rebuild_seconds, 2), 'index_mb': index_mb}]
+
+    queries = (('algemeen', 'reactie'), ('twee algemene termen', 'realistisch tekst'),
+               ('20% van de reacties', 'precies bedoel'), ('één treffer', rare_term))
+    for label, query in queries:
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            page = index.search(query, offset=0, limit=20)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        p50 = statistics.median(timings)
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        results.append({'benchmark': 'search_query', 'comments': args.comments, 'query': label,
+                        'matches': page.total, 'truncated': page.truncated,
+                        'p50_ms': round(p50, 2), 'p99_ms': round(p99, 2)})
+        print(f"{label:>22}: p50 {p50:.2f} ms, p99 {p99:.2f} ms "
+              f"({page.total}{'+' if page.truncated else ''} treffers)")
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Snapshot benchmark: laden en opslaan in JSON en in het binaire formaat.
+
+Gebruik (vanuit de hoofdmap van het project):
+
+    python -m benchmarks.bench_snapshot --comments 200000
+
+Schrijft dezelfde synthetische dataset als data.json en als data.snapshot en
+meet per formaat de bestandsgrootte, de schrijftijd, de laadtijd en het
+piekgeheugen tijdens het laden (tracemalloc, in een aparte meting).
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.bench_memory import generate_posts
+from src.models import Post
+from src.storage import create_storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vergelijk JSON- en binaire snapshots.")
+    parser.add_argument('--comments', type=int, default=200000, help="Totaal aantal comments")
+    parser.add_argument('--comments-per-post', type=int, default=100)
+    args = parser.parse_args()
+
+    posts = [Post.from_dict(json.loads(text)) for text in generate_posts(args.comments, args.comments_per_post, 0.2)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for snapshot_format in ('json', 'binary'):
+            path = os.path.join(tmp_dir, f'{snapshot_format}.json')
+            storage = create_storage('json', path, snapshot_format=snapshot_format)
+            storage.set_state_provider(lambda: ([], posts))
+            start = time.perf_counter()
+            storage.compact()
+            save_seconds = time.perf_counter() - start
+
+            gc.collect()
+            start = time.perf_counter()
+            create_storage('json', path, snapshot_format=snapshot_format).load()
+            load_seconds = time.perf_counter() - start
+
+            gc.collect()
+            tracemalloc.start()
+            loaded = create_storage('json', path, snapshot_format=snapshot_format).load()
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del loaded
+
+            result = {'benchmark': 'snapshot', 'format': snapshot_format, 'comments': args.comments,
+                      'file_mb': round(os.path.getsize(storage.snapshot_path) / 1e6, 1),
+                      'save_s': round(save_seconds, 2), 'load_s': round(load_seconds, 2),
+                      'load_peak_mb': round(peak / 1e6, 1), 'retained_mb': round(retained / 1e6, 1)}
+            results.append(result)
+            print(f"{snapshot_format:>6}: {result['file_mb']} MB op schijf, opslaan {result['save_s']} s, "
+                  f"laden {result['load_s']} s, piekgeheugen {result['load_peak_mb']} MB "
+                  f"(daarna {result['retained_mb']} MB)")
+
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Startup benchmark: hoe lang duurt het om N gebruikers te laden?
+
+Gebruik (vanuit de hoofdmap van het project):
+
+    python -m benchmarks.bench_startup --users 100000
+
+Schrijft een snapshot met N gebruikers naar een tijdelijke map, laadt die via
+de storage backend en vergelijkt dat met de oude manier van laden, waarbij
+User() voor elke gebruiker een wachtwoord-hash berekende.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from werkzeug.security import generate_password_hash
+
+from src.storage import create_storage
+
+
+def write_snapshot(path: str, user_count: int):
+    password_hash = generate_password_hash('wachtwoord') # Eén keer hashen, daarna hergebruiken
+    data = {
+        'users': [
+            {'id': str(uuid.uuid4()), 'username': f'gebruiker{i}', 'password_hash': password_hash}
+            for i in range(user_count)
+        ],
+        'posts': []
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Meet de laadtijd van gebruikers bij het opstarten.")
+    parser.add_argument('--users', type=int, default=100000, help="Aantal gebruikers in de snapshot")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, 'data.json')
+        write_snapshot(snapshot_path, args.users)
+
+        start = time.perf_counter()
+        users, _ = create_storage('json', snapshot_path).load()
+        load_seconds = time.perf_counter() - start
+
+    # Kosten van de oude hydratatie: één generate_password_hash('') per gebruiker
+    samples = 5
+    start = time.perf_counter()
+    for _ in range(samples):
+        generate_password_hash('')
+    hash_seconds = (time.perf_counter() - start) / samples
+
+    result = {
+        'benchmark': 'startup_load_users',
+        'users': len(users),
+        'load_ms': round(load_seconds * 1000, 1),
+        'legacy_estimate_s': round(hash_seconds * args.users, 1),
+    }
+    print(f"{len(users)} gebruikers geladen in {result['load_ms']} ms "
+          f"(oude hydratatie met hashing: ~{result['legacy_estimate_s']} s)")
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import collections
+import contextlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_PASSWORD_METHOD = 'scrypt:32768:8:1' # Standaard van werkzeug, met expliciete parameters
+
+
+class HasherBusy(Exception):
+    """Er wachten al te veel wachtwoord-berekeningen; probeer het later opnieuw."""
+
+
+def _hash_password(password: str, method: str) -> str:
+    return generate_password_hash(password, method=method)
+
+
+def _verify_password(password_hash: str, password: str) -> bool:
+    return check_password_hash(password_hash, password)
+
+
+@contextlib.contextmanager
+def _main_module_hidden():
+    """Laat nieuwe pool-processen het hoofdscript niet opnieuw uitvoeren.
+
+    multiprocessing voert in elk nieuw proces (ook via forkserver) het
+    __main__-script opnieuw uit als __mp_main__; bij `python app.py` is dat de
+    hele app: data laden, moderatie starten. De hashfuncties staan in deze
+    module, dus een leeg __main__ volstaat.
+    """
+    main_module = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main_module
+
+
+class PasswordHasher:
+    """Wachtwoorden hashen en controleren in een begrensde process pool.
+
+    De hashfuncties zijn bewust traag en CPU-zwaar; in aparte processen
+    houden ze de threads die pagina's renderen (en de GIL) vrij. Er mogen
+    maximaal `max_pending` berekeningen tegelijk wachten of lopen; daarboven
+    geeft de hasher direct HasherBusy in plaats van een steeds langere rij.
+
+    Args:
+        workers: Aantal processen in de pool (per worker-proces van de app).
+        max_pending: Maximaal aantal berekeningen in de pool of in de rij.
+        method: Werkzeug hash-methode; bestaande hashes met een andere
+            methode of andere parameters worden bij inloggen vernieuwd.
+        timeout: Seconden die een request maximaal op een resultaat wacht.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 16, method: str = DEFAULT_PASSWORD_METHOD, timeout: float = 10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.method = method
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._method_prefix = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._rehashed = 0
+
+    def _pool(self):
+        """De pool van dit proces (aanroepen met self._lock)."""
+        # Pas na de fork aanmaken (gunicorn --preload): elke worker zijn eigen pool
+        if self._executor is None or self._pid != os.getpid():
+            methods = multiprocessing.get_all_start_methods()
+            if 'forkserver' in methods:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__]) # Alleen deze module, niet de app
+            else:
+                context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise HasherBusy()
+        with self._lock:
+            self._pending += 1
+        try:
+            with self._lock, _main_module_hidden(): # submit() start zo nodig een nieuw proces
+                future = self._pool().submit(fn, *args)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done) # Plek pas vrijgeven als de berekening echt klaar is
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HasherBusy()
+
+    def _done(self, future):
+        self._slots.release()
+        with self._lock:
+            self._pending -= 1
+            if future is not None:
+                self._completed += 1
+
+    def hash(self, password: str) -> str:
+        return self._run(_hash_password, password, self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return self._run(_verify_password, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True als de hash met een andere methode of andere parameters gemaakt is."""
+        if self._method_prefix is None:
+            # 'scrypt' en 'scrypt:32768:8:1' geven dezelfde hashes; vergelijk met een echte hash
+            self._method_prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def record_rehash(self):
+        with self._lock:
+            self._rehashed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': self._pending,
+                'max_pending': self.max_pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'rehashed': self._rehashed,
+            }
+
+
+class TokenBucketLimiter:
+    """Token bucket per sleutel (bv. IP-adres of gebruikersnaam).
+
+    Elke sleutel heeft maximaal `burst` tokens die met `per_minute` per minuut
+    aangevuld worden. De store is een begrensde LRU in het geheugen van dit
+    proces: de minst recent gebruikte sleutels vallen eruit (en beginnen dan
+    weer met een volle bucket).
+    """
+
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 100000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict() # sleutel -> (tokens, laatst bijgewerkt)
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def _tokens(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def available(self, key) -> bool:
+        """Is er nog een token, zonder er een te gebruiken?"""
+        with self._lock:
+            return self._tokens(key, time.monotonic()) >= 1
+
+    def try_acquire(self, key) -> bool:
+        """Gebruik één token; False als de bucket leeg is."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'keys': len(self._buckets), 'limited': self.limited}
@@ -0,0 +1,208 @@
+import atexit
+import json
+import os
+import queue
+import socket
+import threading
+
+from src.log import log_warning
+
+MAX_DATAGRAM_BYTES = 64 * 1024 # Groter event past niet in één datagram en wordt niet doorgestuurd
+
+
+class TooManySubscribers(Exception):
+    """Het maximum aantal live verbindingen voor deze worker is bereikt."""
+
+
+def format_event(event_type: str, data: dict) -> str:
+    """Eén server-sent event in het tekstformaat van de EventSource API."""
+    return f"event: {event_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    """De wachtrij van één verbonden client.
+
+    Een client die niet bijhoudt (wachtrij vol) wordt afgesloten in plaats van
+    de publisher op te houden; de browser maakt zelf opnieuw verbinding.
+    """
+
+    def __init__(self, broker, max_pending: int):
+        self._broker = broker
+        self._messages = queue.Queue(maxsize=max_pending)
+        self.closed = False
+
+    def offer(self, message: str) -> bool:
+        try:
+            self._messages.put_nowait(message)
+            return True
+        except queue.Full:
+            self.closed = True
+            return False
+
+    def get(self, timeout: float):
+        """Volgende bericht, of None als er binnen `timeout` seconden niets kwam."""
+        try:
+            return self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        self._broker._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SocketRelay:
+    """Verspreidt events over alle workers op deze machine via Unix datagram sockets.
+
+    Elk proces bindt een socket `<pid>.sock` in een gedeelde map en stuurt
+    elk event naar de sockets van de andere processen. Er is geen aparte
+    broker-proces nodig; sockets van gestopte workers worden opgeruimd
+    zodra een verzending faalt.
+    """
+
+    def __init__(self, directory: str, on_message):
+        self.directory = directory
+        self.on_message = on_message
+        self._pid = None
+        self._lock = threading.Lock()
+        self._receiver = None
+        self._sender = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+
+    def _own_name(self):
+        return f"{os.getpid()}.sock"
+
+    def _ensure_started(self):
+        # Pas na de fork binden (gunicorn --preload): elke worker zijn eigen socket
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, self._own_name())
+            if os.path.exists(path):
+                os.remove(path) # Restant van een eerder proces met hetzelfde pid
+            self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._receiver.bind(path)
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False) # Een volle peer mag de publisher nooit blokkeren
+            self._pid = os.getpid()
+            threading.Thread(target=self._listen, args=(self._receiver,), name="event-relay", daemon=True).start()
+            atexit.register(_remove_quietly, path)
+
+    def start(self):
+        self._ensure_started()
+
+    def send(self, message: str):
+        self._ensure_started()
+        payload = message.encode('utf-8')
+        if len(payload) > MAX_DATAGRAM_BYTES:
+            self.dropped += 1
+            return
+        own_name = self._own_name()
+        for name in os.listdir(self.directory):
+            if name == own_name or not name.endswith('.sock'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                self._sender.sendto(payload, path)
+                self.sent += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                _remove_quietly(path) # Worker bestaat niet meer
+            except OSError:
+                self.dropped += 1 # Buffer van de ontvanger vol
+
+    def _listen(self, receiver):
+        while True:
+            try:
+                payload = receiver.recv(MAX_DATAGRAM_BYTES)
+            except OSError:
+                return
+            self.received += 1
+            self.on_message(payload.decode('utf-8'))
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class EventBroker:
+    """Publish/subscribe voor live updates (server-sent events).
+
+    publish() formatteert een event één keer en zet het in de wachtrij van
+    elke verbonden client van deze worker; met een `relay_dir` gaat het ook
+    naar de andere workers op dezelfde machine.
+
+    Args:
+        relay_dir: Gedeelde map voor de sockets van de workers (None = alleen dit proces).
+        max_clients: Maximaal aantal gelijktijdige streams per worker; elke
+            stream houdt een thread bezet.
+        max_pending: Aantal berichten dat een trage client achter mag lopen.
+    """
+
+    def __init__(self, relay_dir: str = None, max_clients: int = 100, max_pending: int = 100):
+        self.max_clients = max_clients
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._published = 0
+        self._slow_clients = 0
+        self._relay = None
+        if relay_dir and hasattr(socket, 'AF_UNIX'):
+            self._relay = SocketRelay(relay_dir, self._dispatch)
+
+    def subscribe(self) -> Subscription:
+        if self._relay is not None:
+            self._relay.start() # Ook luisteren in workers die zelf nog niets publiceerden
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                raise TooManySubscribers()
+            subscription = Subscription(self, self.max_pending)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_type: str, data: dict):
+        message = format_event(event_type, data)
+        self._dispatch(message)
+        if self._relay is not None:
+            try:
+                self._relay.send(message)
+            except OSError as e:
+                log_warning('event_relay_failed', error=str(e))
+
+    def _dispatch(self, message: str):
+        with self._lock:
+            self._published += 1
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.offer(message):
+                self._unsubscribe(subscription)
+                with self._lock:
+                    self._slow_clients += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                'clients': len(self._subscribers),
+                'max_clients': self.max_clients,
+                'published': self._published,
+                'slow_clients_dropped': self._slow_clients,
+            }
+        if self._relay is not None:
+            stats.update(relay_sent=self._relay.sent, relay_received=self._relay.received,
+                         relay_dropped=self._relay.dropped)
+        return stats
@@ -0,0 +1,53 @@
+import collections
+import threading
+
+
+class FragmentCache:
+    """LRU cache voor gerenderde HTML-fragmenten, met een versie per post.
+
+    Een fragment hoort bij (post id, variant) en is geldig zolang de versie van
+    de post niet veranderd is. bump() verhoogt de versie na elke wijziging
+    (nieuwe comment, gemodereerde tekst, afbeeldingsvarianten), zodat de
+    volgende render het fragment opnieuw opbouwt.
+    """
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max_entries
+        self._versions = {} # post id -> versie
+        self._entries = collections.OrderedDict() # (post id, variant) -> (versie, html)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, post_id: str):
+        with self._lock:
+            self._versions[post_id] = self._versions.get(post_id, 0) + 1
+
+    def get_or_render(self, post_id: str, variant, render):
+        """Geef het gecachte fragment, of render het met render() en bewaar het."""
+        key = (post_id, variant)
+        with self._lock:
+            version = self._versions.get(post_id, 0)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        html = render() # Buiten de lock renderen; bij een race wint gewoon de laatste
+        with self._lock:
+            if self._versions.get(post_id, 0) == version: # Niet bewaren als er intussen iets veranderde
+                self._entries[key] = (version, html)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.log import log_error
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow is optioneel: zonder Pillow serveren we alleen de originelen
+    Image = None
+
+VARIANT_WIDTHS = (320, 800) # Thumbnail en feed-breedte
+CHUNK_SIZE = 64 * 1024
+# Formaten die we opnieuw encoderen; GIF laten we ongemoeid (animaties)
+REENCODE_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG'}
+# Bestandsnamen op basis van de inhoud (sha256), eventueel met variant-breedte
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}(_\d+)?\.[a-z]+$')
+
+
+class ImageTooLarge(Exception):
+    """De upload is groter dan de ingestelde limiet."""
+
+
+def variant_filename(filename: str, width: int, extension: str = None) -> str:
+    """Bestandsnaam van een verkleinde variant, bv. abc.jpg -> abc_320.webp."""
+    stem, _, original_extension = filename.rpartition('.')
+    return f"{stem}_{width}.{extension or original_extension}"
+
+
+class ImagePipeline:
+    """Verwerkt uploads voor posts: begrensde opslag en verkleinde varianten.
+
+    save_upload() streamt het bestand in blokken naar een tijdelijk bestand en
+    breekt af zodra de limiet overschreden wordt. Het bestand krijgt de
+    sha256 van de inhoud als naam, zodat dezelfde afbeelding maar één keer
+    op schijf staat. schedule() maakt buiten het request om varianten
+    (origineel formaat + WebP) per breedte.
+    """
+
+    def __init__(self, upload_folder: str, max_bytes: int = 5 * 1024 * 1024, widths=VARIANT_WIDTHS, workers: int = 2):
+        self.upload_folder = upload_folder
+        self.max_bytes = max_bytes
+        self.widths = tuple(widths)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-worker")
+        self._lock = threading.Lock()
+        self._in_flight = {} # bestandsnaam -> callbacks die op de lopende verwerking wachten
+        self._processed = {} # bestandsnaam -> gemaakte breedtes (ook [] voor te kleine afbeeldingen)
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None
+
+    def save_upload(self, file_storage, extension: str):
+        """Sla een upload op onder zijn inhoudshash.
+
+        Returns:
+            (bestandsnaam, nieuw): `nieuw` is False als exact dezelfde afbeelding
+            al bestond; er is dan niets extra op schijf gezet.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_folder, suffix='.upload')
+        try:
+            digest = hashlib.sha256()
+            written = 0
+            with os.fdopen(fd, 'wb') as tmp_file:
+                while True:
+                    chunk = file_storage.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > self.max_bytes:
+                        raise ImageTooLarge(f"Afbeelding groter dan {self.max_bytes // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+            extension = 'jpg' if extension == 'jpeg' else extension # Eén naam per inhoud
+            filename = f"{digest.hexdigest()}.{extension}"
+            path = os.path.join(self.upload_folder, filename)
+            with self._lock:
+                is_new = not os.path.exists(path)
+                if is_new:
+                    os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path) # Duplicaat of afgebroken upload
+        return filename, is_new
+
+    def existing_variants(self, filename: str) -> list[int]:
+        """Breedtes waarvan de varianten (incl. WebP) al op schijf staan."""
+        return [width for width in self.widths
+                if os.path.exists(os.path.join(self.upload_folder, variant_filename(filename, width, 'webp')))
+                and os.path.exists(os.path.join(self.upload_folder, variant_filename(filename, width)))]
+
+    def schedule(self, filename: str, on_done):
+        """Maak varianten op de achtergrond; roept on_done(widths) aan als ze klaar zijn.
+
+        Per bestand loopt hooguit één verwerking: een duplicaat dat binnenkomt
+        terwijl die nog bezig is wacht op hetzelfde resultaat, en een bestand
+        dat al verwerkt is wordt niet opnieuw verwerkt.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            widths = self._processed.get(filename)
+            if widths is None:
+                callbacks = self._in_flight.get(filename)
+                if callbacks is not None:
+                    callbacks.append(on_done)
+                    return
+                self._in_flight[filename] = [on_done]
+        if widths is None:
+            self._executor.submit(self._process_and_report, filename)
+        elif widths:
+            on_done(widths)
+
+    def _process_and_report(self, filename):
+        try:
+            widths = self.create_variants(filename)
+        except Exception as e:
+            log_error('image_processing_failed', filename=filename, error=str(e))
+            widths = None
+        with self._lock:
+            callbacks = self._in_flight.pop(filename)
+            if widths is not None:
+                self._processed[filename] = widths
+        for on_done in callbacks if widths else ():
+            on_done(widths)
+
+    def create_variants(self, filename: str) -> list[int]:
+        """Schrijf verkleinde varianten; geeft de breedtes terug die gemaakt zijn."""
+        extension = filename.rsplit('.', 1)[-1].lower()
+        image_format = REENCODE_FORMATS.get(extension)
+        if image_format is None:
+            return []
+        source_path = os.path.join(self.upload_folder, filename)
+        created = []
+        with Image.open(source_path) as source:
+            image = ImageOps.exif_transpose(source) # Rotatie uit EXIF toepassen; EXIF zelf vervalt
+            for width in self.widths:
+                if width >= image.width:
+                    break # Nooit opschalen; het origineel is dan klein genoeg
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.LANCZOS)
+                if image_format == 'JPEG' and resized.mode not in ('RGB', 'L'):
+                    resized = resized.convert('RGB')
+                self._save_atomic(resized, variant_filename(filename, width), image_format,
+                                  quality=82, optimize=True)
+                self._save_atomic(resized, variant_filename(filename, width, 'webp'), 'WEBP', quality=80)
+                created.append(width)
+        return created
+
+    def _save_atomic(self, image, filename, image_format, **options):
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                image.save(tmp_file, image_format, **options)
+            os.replace(tmp_path, os.path.join(self.upload_folder, filename))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path) # Afgebroken schrijven
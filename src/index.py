@@ -0,0 +1,92 @@
+import bisect
+import datetime
+
+from src.models import User, Post, Comment
+
+
+def username_key(username: str) -> str:
+    """Normaliseer een gebruikersnaam voor hoofdletterongevoelig opzoeken."""
+    return username.casefold()
+
+
+def feed_cursor(post: Post) -> str:
+    """Cursor voor de feed: 'timestamp,id' van de laatst getoonde post."""
+    return f"{post.timestamp.isoformat()},{post.id}"
+
+
+def parse_feed_cursor(value: str):
+    """Zet een cursor om naar een sorteersleutel; None bij een ongeldige cursor."""
+    timestamp, _, post_id = (value or '').partition(',')
+    try:
+        parsed = datetime.datetime.fromisoformat(timestamp)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        return None # feed_keys zijn naïef; vergelijken zou een TypeError geven
+    return (parsed, post_id)
+
+
+class DataIndex:
+    """In-memory opzoektabellen voor users, posts en comments.
+
+    Vervangt lineaire zoekacties door O(1) dict-lookups. Moet bij elke mutatie
+    bijgewerkt worden (add_*) en na het laden opnieuw opgebouwd (rebuild).
+    """
+
+    def __init__(self):
+        self.users_by_id = {}
+        self.users_by_key = {} # username_key -> User
+        self.usernames = {} # user id -> username, direct bruikbaar in templates
+        self.posts_by_id = {}
+        self.comments_by_id = {}
+        self.feed_keys = [] # (timestamp, post id), gesorteerd van oud naar nieuw
+
+    def rebuild(self, users, posts):
+        for table in (self.users_by_id, self.users_by_key, self.usernames, self.posts_by_id, self.comments_by_id, self.feed_keys):
+            table.clear()
+        for user in users:
+            self.add_user(user)
+        for post in posts:
+            self._add_post_tables(post)
+            self.feed_keys.append((post.timestamp, post.id))
+        self.feed_keys.sort() # Eén keer sorteren i.p.v. per post invoegen
+
+    def add_user(self, user: User):
+        self.users_by_id[user.id] = user
+        self.users_by_key[username_key(user.username)] = user
+        self.usernames[user.id] = user.username
+
+    def add_post(self, post: Post):
+        self._add_post_tables(post)
+        # Nieuwe posts zijn bijna altijd de nieuwste, dus invoegen gebeurt aan het eind
+        bisect.insort(self.feed_keys, (post.timestamp, post.id))
+
+    def _add_post_tables(self, post: Post):
+        self.posts_by_id[post.id] = post
+        self._add_comment_tree(post.comments)
+
+    def add_comment(self, comment: Comment):
+        self.comments_by_id[comment.id] = comment
+        self._add_comment_tree(comment.replies)
+
+    def _add_comment_tree(self, comments):
+        for comment in comments:
+            self.add_comment(comment)
+
+    def user(self, user_id):
+        return self.users_by_id.get(user_id)
+
+    def user_by_username(self, username):
+        return self.users_by_key.get(username_key(username))
+
+    def post(self, post_id):
+        return self.posts_by_id.get(post_id)
+
+    def comment(self, comment_id):
+        return self.comments_by_id.get(comment_id)
+
+    def recent_posts(self, before=None, limit: int = 20):
+        """Geef maximaal `limit` posts van nieuw naar oud, ouder dan sleutel `before`."""
+        end = len(self.feed_keys) if before is None else bisect.bisect_left(self.feed_keys, before)
+        start = max(0, end - limit)
+        return [self.posts_by_id[post_id] for _, post_id in reversed(self.feed_keys[start:end])]
@@ -0,0 +1,70 @@
+"""Gestructureerde logging: één regel per gebeurtenis met vaste velden.
+
+DIALINK_LOG_MODE kiest het formaat:
+
+    text   leesbare regels: '... INFO data_loaded users=3 posts=10' (standaard)
+    json   één JSON-object per regel, voor log-aggregatie
+    quiet  alleen waarschuwingen en fouten; info-events worden afgewezen
+           voordat er iets geformatteerd wordt
+
+Logregels bevatten nooit de tekst van posts of reacties, alleen id's,
+lengtes en tellers.
+"""
+import datetime
+import json
+import logging
+import os
+import sys
+
+LOG_MODES = ('text', 'json', 'quiet')
+
+_logger = logging.getLogger('dialink')
+
+
+class _EventFormatter(logging.Formatter):
+    def __init__(self, as_json: bool):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        timestamp = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds')
+        fields = getattr(record, 'fields', {})
+        if self.as_json:
+            return json.dumps({'ts': timestamp, 'level': record.levelname.lower(), 'event': record.getMessage(), **fields},
+                              ensure_ascii=False, default=str)
+        pairs = ' '.join(f"{key}={_text_value(value)}" for key, value in fields.items())
+        return f"{timestamp} {record.levelname} {record.getMessage()}" + (f" {pairs}" if pairs else '')
+
+
+def _text_value(value) -> str:
+    text = str(value)
+    return json.dumps(text, ensure_ascii=False) if (' ' in text or '"' in text or not text) else text
+
+
+def configure(mode: str = None):
+    """Stel formaat en niveau in (standaard uit DIALINK_LOG_MODE)."""
+    mode = mode or os.getenv('DIALINK_LOG_MODE', 'text')
+    if mode not in LOG_MODES:
+        raise ValueError(f"Onbekende DIALINK_LOG_MODE: {mode} (kies uit {', '.join(LOG_MODES)})")
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(_EventFormatter(as_json=mode == 'json'))
+    _logger.handlers[:] = [handler]
+    _logger.setLevel(logging.WARNING if mode == 'quiet' else logging.INFO)
+    _logger.propagate = False
+
+
+def log_event(event: str, **fields):
+    """Log een gebeurtenis (info) met key=value velden."""
+    if _logger.isEnabledFor(logging.INFO):
+        _logger.info(event, extra={'fields': fields})
+
+
+def log_warning(event: str, **fields):
+    _logger.warning(event, extra={'fields': fields})
+
+
+def log_error(event: str, **fields):
+    _logger.error(event, extra={'fields': fields})
+
+
+configure()
@@ -0,0 +1,141 @@
+import bisect
+import threading
+
+# Standaard grenzen (seconden) voor latency-histogrammen
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Voor trage bewerkingen zoals laden en snapshots van de hele dataset
+SLOW_OPERATION_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Histogram:
+    """Thread-safe histogram met vaste bucket-grenzen (Prometheus-stijl)."""
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1) # Laatste bucket is +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[position] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        """Cumulatieve tellingen per bovengrens, plus som en aantal."""
+        with self._lock:
+            cumulative = {}
+            running = 0
+            for bound, count in zip(self.buckets + ('+Inf',), self._counts):
+                running += count
+                cumulative[str(bound)] = running
+            return {'buckets': cumulative, 'sum': round(self._sum, 6), 'count': self._count}
+
+
+class MetricsRegistry:
+    """Verzamelt metrics en zet ze om naar het Prometheus tekstformaat (/metrics).
+
+    Histogrammen kunnen een label hebben (bv. de route); per
+    labelwaarde ontstaat bij de eerste observatie een eigen instantie.
+    Bestaande stats()-methodes (wachtrij, caches, ...) worden bij elke scrape
+    uitgelezen en de opgegeven velden als counter of gauge getoond.
+    """
+
+    def __init__(self):
+        self._families = {} # naam -> (type, help, label, {labelwaarde: Histogram})
+        self._collectors = [] # (prefix, functie die een dict teruggeeft, {veld: (soort, help)})
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, buckets=DEFAULT_LATENCY_BUCKETS, label: str = None):
+        return _Family(self, name, 'histogram', help_text, label, lambda: Histogram(buckets))
+
+    def register(self, name: str, help_text: str, metric):
+        """Registreer een bestaande Histogram (zonder label)."""
+        with self._lock:
+            self._families[name] = ('histogram', help_text, None, {None: metric})
+        return metric
+
+    def register_stats(self, prefix: str, stats_fn, fields: dict):
+        """Toon velden van `stats_fn()` als metrics.
+
+        Args:
+            fields: veld -> (soort, help). 'counter' is voor totalen die alleen
+                oplopen en heet `<prefix>_<veld>_total`; 'gauge' is een
+                momentopname en heet `<prefix>_<veld>`.
+        """
+        with self._lock:
+            self._collectors.append((prefix, stats_fn, fields))
+
+    def _child(self, name, kind, help_text, label, factory, value):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = (kind, help_text, label, {})
+            children = family[3]
+            metric = children.get(value)
+            if metric is None:
+                metric = children[value] = factory()
+            return metric
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = sorted(self._families.items())
+            collectors = list(self._collectors)
+        for name, (kind, help_text, label, children) in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for value, metric in sorted(children.items(), key=lambda item: str(item[0])):
+                labels = {label: value} if label else {}
+                snapshot = metric.snapshot()
+                for bound, count in snapshot['buckets'].items():
+                    lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {snapshot['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+        for prefix, stats_fn, fields in collectors:
+            try:
+                stats = stats_fn()
+            except Exception as e: # Eén kapotte bron mag de hele scrape niet breken
+                lines.append(f"# {prefix}: {type(e).__name__}")
+                continue
+            for key, (kind, help_text) in fields.items():
+                value = stats.get(key)
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue # Ontbreekt (bv. relay-tellers zonder relay)
+                name = f"{prefix}_{key}_total" if kind == 'counter' else f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class _Family:
+    """Een metric met (optioneel) één label; labels(waarde) geeft de instantie."""
+
+    def __init__(self, registry, name, kind, help_text, label, factory):
+        self._registry = registry
+        self._args = (name, kind, help_text, label, factory)
+        self._unlabeled = None if label else registry._child(*self._args, None)
+
+    def labels(self, value):
+        return self._registry._child(*self._args, value)
+
+    def observe(self, value: float):
+        self._unlabeled.observe(value)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Gedeeld register voor de hele app (zoals moderation_cache in src/moderation.py)
+registry = MetricsRegistry()
@@ -0,0 +1,35 @@
+"""Eenmalige migratie tussen storage backends.
+
+Gebruik (vanuit de hoofdmap van het project):
+
+    python -m src.migrate data.json data.db
+    python -m src.migrate data.db data.json --source sqlite --target json
+"""
+import argparse
+
+from src.storage import create_storage
+
+
+def migrate(source_backend: str, source_path: str, target_backend: str, target_path: str):
+    """Lees alle data uit de bron en schrijf die in één keer naar het doel."""
+    source = create_storage(source_backend, source_path)
+    users, posts = source.load()
+    target = create_storage(target_backend, target_path)
+    target.import_data(users, posts)
+    return users, posts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migreer Dialink data naar een andere storage backend.")
+    parser.add_argument('source_path', help="Pad naar de bron (bv. data.json)")
+    parser.add_argument('target_path', help="Pad naar het doel (bv. data.db)")
+    parser.add_argument('--source', default='json', choices=['json', 'sqlite'], help="Backend van de bron")
+    parser.add_argument('--target', default='sqlite', choices=['json', 'sqlite'], help="Backend van het doel")
+    args = parser.parse_args()
+
+    users, posts = migrate(args.source, args.source_path, args.target, args.target_path)
+    print(f"Gemigreerd: {len(users)} gebruikers, {len(posts)} posts van {args.source_path} naar {args.target_path}")
+
+
+if __name__ == "__main__":
+    main()
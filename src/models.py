@@ -1,12 +1,56 @@
 import datetime
+import sys
 import uuid
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Elk proces houdt de hele dataset in het geheugen, dus de modellen zijn compact:
+# __slots__ in plaats van een __dict__ per object, id-verwijzingen delen het
+# string-object van het object waarnaar ze verwijzen, en een comment zonder
+# replies deelt één lege tuple.
+NO_REPLIES = ()
+
+def intern_id(value):
+    """Deel één string-object per id (user ids komen in elke post en comment terug)."""
+    return sys.intern(value) if value is not None else None
+
+# Tijdstempels als geheel aantal microseconden sinds dit (naïeve) epoch, zoals in de snapshot
+TIMESTAMP_EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+class _Timestamped:
+    """Tijdstempel die als int geladen kan worden en pas bij gebruik een datetime wordt.
+
+    Uit een binaire snapshot komen tijdstempels als microseconden; de meeste
+    comments worden nooit getoond, dus de omzetting naar datetime (en de extra
+    bytes van een datetime-object) doen we pas bij de eerste toegang.
+    """
+    __slots__ = ('_timestamp',)
+
+    @property
+    def timestamp(self):
+        value = self._timestamp
+        if value.__class__ is int:
+            value = self._timestamp = TIMESTAMP_EPOCH + datetime.timedelta(microseconds=value)
+        return value
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = value
+
+    @property
+    def timestamp_us(self) -> int:
+        """Tijdstempel als int (microseconden), zonder een datetime aan te maken."""
+        value = self._timestamp
+        return value if value.__class__ is int else (value - TIMESTAMP_EPOCH) // ONE_MICROSECOND
+
 class User:
-    def __init__(self, username, password):
-        self.id = str(uuid.uuid4())
+    __slots__ = ('id', 'username', 'password_hash')
+
+    def __init__(self, username, password=None, password_hash=None):
+        self.id = intern_id(str(uuid.uuid4()))
         self.username = username
-        self.password_hash = generate_password_hash(password)
+        # De app hasht zelf in een process pool (src/auth.py) en geeft de hash mee
+        self.password_hash = password_hash if password_hash is not None else generate_password_hash(password)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -20,22 +64,33 @@ class User:
         }
 
     # Helper om user te laden vanuit dict (JSON)
+    # Hydratatie gaat buiten __init__ om: die zou een nieuwe uuid maken en een
+    # (bewust trage) wachtwoord-hash berekenen die we toch meteen overschrijven.
     @staticmethod
     def from_dict(data):
-        user = User(username=data['username'], password='') # Dummy password, hash is al gezet
-        user.id = data['id']
+        user = User.__new__(User)
+        user.id = intern_id(data['id'])
+        user.username = data['username']
         user.password_hash = data['password_hash']
         return user
 
-class Post:
+class Post(_Timestamped):
+    __slots__ = ('id', 'user_id', 'content', 'image_filename', 'image_variants', 'comments')
+
     def __init__(self, user_id: str, content: str, image_filename: str = None):
         self.id = str(uuid.uuid4())
-        self.user_id = user_id # Veranderd van user naar user_id
+        self.user_id = intern_id(user_id) # Veranderd van user naar user_id
         self.content = content
         self.image_filename = image_filename # Nieuw veld voor afbeelding
+        self.image_variants = [] # Breedtes van de verkleinde varianten die klaar zijn
         self.timestamp = datetime.datetime.now()
         self.comments = []
 
+    def add_comment(self, comment: 'Comment'):
+        """Voeg een top-level comment toe; comment.post_id deelt daarna onze id-string."""
+        comment.post_id = self.id
+        self.comments.append(comment)
+
     def __str__(self):
         return f"Post van {self.user_id} ({self.timestamp}):\n{self.content}"
 
@@ -46,6 +101,7 @@ class Post:
             "user_id": self.user_id,
             "content": self.content,
             "image_filename": self.image_filename,
+            "image_variants": self.image_variants,
             "timestamp": self.timestamp.isoformat(), # Sla op als ISO string
             "comments": [c.to_dict() for c in self.comments]
         }
@@ -53,24 +109,56 @@ class Post:
     # Helper om post te laden vanuit dict (JSON)
     @staticmethod
     def from_dict(data):
-        post = Post(user_id=data['user_id'], content=data['content'], image_filename=data.get('image_filename'))
+        post = Post.__new__(Post) # Geen nieuwe uuid/timestamp nodig, alles komt uit data
         post.id = data['id']
+        post.user_id = intern_id(data['user_id'])
+        post.content = data['content']
+        post.image_filename = data.get('image_filename')
+        post.image_variants = data.get('image_variants', [])
         post.timestamp = datetime.datetime.fromisoformat(data['timestamp'])
-        post.comments = [Comment.from_dict(c_data) for c_data in data['comments']]
+        post.comments = []
+        for c_data in data.get('comments', []):
+            post.add_comment(Comment.from_dict(c_data))
         return post
 
-class Comment:
-    def __init__(self, user_id: str, content: str, post_id: str, original_content: str = None, parent_comment_id: str = None):
+# Moderatiestatus van een comment
+COMMENT_PENDING = 'pending' # Geaccepteerd, wacht nog op de moderator
+COMMENT_PUBLISHED = 'published' # Gemodereerde tekst is beschikbaar
+
+class Comment(_Timestamped):
+    __slots__ = ('id', 'post_id', 'parent_comment_id', 'user_id', 'original_content', '_moderated_content',
+                 'replies', 'status')
+
+    def __init__(self, user_id: str, content: str, post_id: str, original_content: str = None, parent_comment_id: str = None, status: str = COMMENT_PUBLISHED):
         self.id = str(uuid.uuid4()) # Unique ID for the comment itself
         self.post_id = post_id # ID of the post this comment belongs to
         self.parent_comment_id = parent_comment_id # ID of the comment this is a reply to (None for top-level)
-        self.user_id = user_id # Veranderd van user naar user_id
+        self.user_id = intern_id(user_id) # Veranderd van user naar user_id
         self.original_content = original_content if original_content is not None else content
         self.moderated_content = content
         self.timestamp = datetime.datetime.now()
-        self.replies = [] # List to hold nested replies (Comment objects)
+        self.replies = NO_REPLIES # Wordt een lijst bij de eerste reply (Comment objects)
+        self.status = status
+
+    @property
+    def moderated_content(self):
+        return self._moderated_content
+
+    @moderated_content.setter
+    def moderated_content(self, text):
+        # Meestal laat de moderator de tekst ongewijzigd: bewaar die dan maar één keer
+        self._moderated_content = self.original_content if text == self.original_content else text
+
+    @property
+    def is_pending(self):
+        return self.status == COMMENT_PENDING
 
     def add_reply(self, reply: 'Comment'):
+        # Verwijzingen naar parent en post delen daarna de id-strings van de parent
+        reply.parent_comment_id = self.id
+        reply.post_id = self.post_id
+        if not self.replies:
+            self.replies = []
         self.replies.append(reply)
 
     def __str__(self):
@@ -87,20 +175,23 @@ class Comment:
             "original_content": self.original_content,
             "moderated_content": self.moderated_content,
             "timestamp": self.timestamp.isoformat(),
+            "status": self.status,
             "replies": [r.to_dict() for r in self.replies]
         }
 
     # Helper om comment te laden vanuit dict (JSON)
     @staticmethod
     def from_dict(data):
-        comment = Comment(
-            user_id=data['user_id'],
-            content=data['moderated_content'], # Start met gemodereerde content
-            post_id=data['post_id'],
-            original_content=data['original_content'],
-            parent_comment_id=data.get('parent_comment_id') # Gebruik .get() voor optioneel veld
-        )
+        comment = Comment.__new__(Comment) # Geen nieuwe uuid/timestamp nodig, alles komt uit data
         comment.id = data['id']
+        comment.post_id = data['post_id']
+        comment.parent_comment_id = data.get('parent_comment_id') # Gebruik .get() voor optioneel veld
+        comment.user_id = intern_id(data['user_id'])
+        comment.original_content = data['original_content']
+        comment.moderated_content = data['moderated_content']
         comment.timestamp = datetime.datetime.fromisoformat(data['timestamp'])
-        comment.replies = [Comment.from_dict(r_data) for r_data in data['replies']]
+        comment.status = data.get('status', COMMENT_PUBLISHED) # Oude data heeft geen status
+        comment.replies = NO_REPLIES
+        for r_data in data.get('replies', []):
+            comment.add_reply(Comment.from_dict(r_data))
         return comment 
\ No newline at end of file
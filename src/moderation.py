@@ -1,103 +1,229 @@
 from src.models import Comment
-import google.generativeai as genai
+from src.moderation_backends import create_backend
+from src.moderation_cache import ModerationCache
+from src.moderation_prompt import PROMPT_VERSION, build_batch_prompt, build_history, build_prompt
+from src.moderation_rules import is_trivially_compliant, mask_flagged_terms
+from src.resilience import CircuitBreaker, CircuitOpenError, ResilientClient
+from src.log import log_error, log_warning
+from src.metrics import registry
+import json
 import os
-
-# Laad de API-sleutel uit het .env bestand
-API_KEY = os.getenv("GOOGLE_API_KEY")
-
-if not API_KEY:
-    raise ValueError("API sleutel niet gevonden. Zorg dat deze in het .env bestand staat als GOOGLE_API_KEY=jouw_sleutel")
-
-genai.configure(api_key=API_KEY)
-
-# Configuratie voor het generatieve model
-generation_config = {
-    "temperature": 0.6,
-    "top_p": 1,
-    "top_k": 1,
-    "max_output_tokens": 2048,
-}
-
-safety_settings = [
-    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-]
-
-model = genai.GenerativeModel(model_name="gemini-2.5-flash-preview-04-17",
-                              generation_config=generation_config,
-                              safety_settings=safety_settings)
+import re
+import time
+
+# Welke backend modereert: 'gemini' (standaard) of 'fake' (lokaal, zonder netwerk).
+# De Gemini client wordt pas bij de eerste aanroep aangemaakt, dus importeren
+# werkt ook zonder GOOGLE_API_KEY.
+backend = create_backend(os.getenv("DIALINK_MODERATION_BACKEND", "gemini"))
+
+# Deadline per aanroep, begrensde retries en een circuit breaker rond de backend
+moderation_client = ResilientClient(
+    backend.generate,
+    timeout=float(os.getenv("DIALINK_MODERATION_TIMEOUT", 10)),
+    deadline=float(os.getenv("DIALINK_MODERATION_DEADLINE", 20)),
+    max_retries=int(os.getenv("DIALINK_MODERATION_RETRIES", 2)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("DIALINK_BREAKER_FAILURES", 5)),
+        reset_timeout=float(os.getenv("DIALINK_BREAKER_RESET", 30)),
+    ),
+)
+
+def local_fallback(text: str) -> str:
+    """Goedkope lokale moderatie als de AI niet beschikbaar is: maskeer gemarkeerde woorden."""
+    return mask_flagged_terms(text)
+
+# Cache voor moderatie-resultaten; met DIALINK_MODERATION_CACHE_FILE overleeft die een herstart
+moderation_cache = ModerationCache(
+    max_entries=int(os.getenv("DIALINK_MODERATION_CACHE_SIZE", 1000)),
+    ttl_seconds=float(os.getenv("DIALINK_MODERATION_CACHE_TTL", 7 * 24 * 3600)),
+    disk_path=os.getenv("DIALINK_MODERATION_CACHE_FILE"),
+)
+
+# Metrics: duur per uitkomst (fast_path, cache_hit, model, empty_response, breaker_open, error),
+# promptgrootte en de latency per model-aanroep; cache- en client-tellers via hun stats()
+moderation_seconds = registry.histogram('dialink_moderation_seconds', 'Duur van moderate_comment per uitkomst',
+                                        label='outcome')
+prompt_chars = registry.histogram('dialink_moderation_prompt_chars', 'Lengte van de moderatie-prompt in tekens',
+                                  buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+registry.register('dialink_moderation_call_seconds', 'Latency per poging van de model-aanroep', moderation_client.latency)
+registry.register_stats('dialink_moderation_cache', moderation_cache.stats, {
+    'entries': ('gauge', 'Resultaten in de moderatie-cache'),
+    'hits': ('counter', 'Moderaties uit de cache'),
+    'disk_hits': ('counter', 'Cache-hits die van schijf kwamen'),
+    'misses': ('counter', 'Cache-lookups zonder resultaat'),
+    'fast_path': ('counter', 'Reacties die zonder model gepubliceerd werden'),
+    'hit_rate': ('gauge', 'Aandeel cache-hits sinds de start'),
+    'avg_model_seconds': ('gauge', 'Gemiddelde duur van een model-aanroep'),
+    'seconds_saved': ('gauge', 'Geschatte bespaarde modeltijd door cache en fast path'),
+})
+registry.register_stats('dialink_moderation_client', moderation_client.stats, {
+    'breaker_state_code': ('gauge', 'Toestand van de circuit breaker (0 = closed, 1 = half-open, 2 = open)'),
+    'breaker_opened': ('counter', 'Keren dat de circuit breaker openging'),
+    'successes': ('counter', 'Geslaagde model-aanroepen'),
+    'failures': ('counter', 'Mislukte model-aanroepen (na retries)'),
+    'retries': ('counter', 'Herhaalde pogingen van de model-client'),
+    'rejected_open': ('counter', 'Aanroepen geweigerd door een open circuit breaker'),
+})
 
 def moderate_comment(post_content: str, previous_comments: list[Comment], current_comment_text: str, users_dict: dict) -> str:
     """Modereert de huidige reactie op basis van de gesprekscontext met gedetailleerde instructies.
 
     Args:
         post_content: De inhoud van de originele post.
-        previous_comments: Een lijst van voorgaande Comment objecten.
+        previous_comments: Voorgaande Comment objecten in prioriteitsvolgorde
+            (zie select_context_comments); wordt binnen een vast budget afgekapt.
         current_comment_text: De tekst van de huidige, nieuwe reactie.
         users_dict: Dictionary die user IDs koppelt aan usernames.
 
     Returns:
         De gemodereerde (of originele) tekst van de huidige reactie.
     """
+    start = time.perf_counter()
+    moderated_text, outcome = _moderate(post_content, previous_comments, current_comment_text, users_dict)
+    moderation_seconds.labels(outcome).observe(time.perf_counter() - start)
+    return moderated_text
 
-    # Bouw de gespreksgeschiedenis op voor de prompt
-    history = f"Originele Post:\n{post_content}\n\n---\nReacties:\n"
-    if not previous_comments:
-        history += "(Nog geen eerdere reacties)\n"
-    else:
-        for i, comment in enumerate(previous_comments):
-            # Gebruik users_dict om de username op te zoeken
-            username = users_dict.get(comment.user_id, 'Onbekende Gebruiker') 
-            history += f"{i+1}. {username}: {comment.moderated_content}\n"
-    history += "\n---"
-
-    # Nieuwe, gedetailleerde prompt
-    prompt_text = f"""Je bent de **Dialink‑Moderator**, een AI‑filter dat uitsluitend de LAATSTE inzending in een gesprek herschrijft om er een waardige dialoog‑bijdrage van te maken.
-
-### Doel
-Stimuleer begrip, nieuwsgierigheid en samenwerking; voorkom ruzie, spot of minachting.
-
-### Werkwijze
-1. **Veiligheid & respect**
-   • Verwijder elke vorm van haat, bedreiging, schelden of vernedering.
-2. **Behoud kerninformatie**
-   • Laat de feitelijke inhoud, emoties en intentie intact; voeg niets inhoudelijks toe dat er niet was.
-3. **Empathische herformulering**
-   • Vervang "jij‑beschuldigingen" door neutrale observaties of ik‑boodschappen.
-   • Benoem het onderliggende gevoel of belang ("Het klinkt alsof…", "Ik merk dat…").
-4. **Dialoog‑boost**
-   • Sluit af met ÉÉN open, uitnodigende vraag die de ander ruimte geeft om verder te vertellen
-     (bv. "Hoe voelde dat voor jou?", "Wat betekent dat voor je?", "Wat zou je graag willen?").
-5. **Taal & lengte**
-   • Schrijf in dezelfde taal als de originele reactie.
-   • Houd de lengte ongeveer gelijk of iets langer (max. +40 %), zodat de nuance behouden blijft.
-6. **Output‑formaat**
-   • Geef UITSLUITEND de (eventueel herschreven) tekst van de nieuwste reactie terug,
-     zonder aanhalingstekens, markdown of uitleg.
-   • Als de originele reactie al volledig voldoet aan alle bovenstaande punten, stuur die ongewijzigd terug.
-
-{history}
-Nieuwste reactie om te beoordelen en eventueel te herschrijven: {current_comment_text}
-
-Herschreven nieuwste reactie:"""
-
-    prompt_parts = [prompt_text.format(history=history, current_comment_text=current_comment_text)]
+def _moderate(post_content, previous_comments, current_comment_text, users_dict):
+    """Het eigenlijke werk van moderate_comment; geeft (tekst, uitkomst) terug."""
+
+    # Bekende onschuldige reacties ("thanks!", "+1") en pure emoji hoeven niet langs de AI
+    if is_trivially_compliant(current_comment_text):
+        moderation_cache.record_fast_path()
+        return current_comment_text, 'fast_path'
+
+    # Gesprekscontext binnen een vast budget; de digest ervan hoort bij de cache-sleutel
+    history, cache_key = _cache_key(post_content, previous_comments, current_comment_text, users_dict)
+    cached_text = moderation_cache.get(cache_key)
+    if cached_text is not None:
+        return cached_text, 'cache_hit'
+
+    # Prompt in één keer opbouwen
+    prompt = build_prompt(history, current_comment_text)
+    prompt_chars.observe(len(prompt))
 
     try:
-        response = model.generate_content(prompt_parts)
-        if response.parts:
-            moderated_text = response.text.strip()
-            # Verwijder eventuele ongewenste aanhalingstekens aan begin/eind
-            if moderated_text.startswith('"') and moderated_text.endswith('"'):
-                moderated_text = moderated_text[1:-1]
-            # Verwijder ook eventuele markdown-opmaak zoals **
-            moderated_text = moderated_text.replace("**", "")
-            return moderated_text if moderated_text else current_comment_text
+        start = time.perf_counter()
+        response_text = moderation_client.call(prompt)
+        elapsed = time.perf_counter() - start
+        if response_text is not None:
+            moderated_text = _clean_response(response_text)
+            if not moderated_text:
+                return current_comment_text, 'empty_response'
+            moderation_cache.put(cache_key, moderated_text, elapsed) # Alleen echte resultaten cachen
+            return moderated_text, 'model'
         else:
-            print("\n[Moderator Info: Kon geen gemodereerde versie genereren, mogelijk door veiligheidsfilters. Origineel wordt gebruikt.]")
-            return current_comment_text
+            # Geen gemodereerde versie, mogelijk door veiligheidsfilters: lokale moderatie
+            log_warning('moderation_empty_response', prompt_chars=len(prompt))
+            return local_fallback(current_comment_text), 'empty_response'
+    except CircuitOpenError:
+        # Upstream is ongezond: niet wachten, direct de lokale fallback
+        return local_fallback(current_comment_text), 'breaker_open'
     except Exception as e:
-        print(f"\n[Moderator Fout: Er is een fout opgetreden bij het aanroepen van de AI: {e}]")
-        return current_comment_text 
\ No newline at end of file
+        log_error('moderation_call_failed', error_type=type(e).__name__, error=str(e)[:200])
+        return local_fallback(current_comment_text), 'error'
+
+
+# **tekst** als losse opmaak: niet midden in een woord en niet tegen andere sterretjes aan
+BOLD_MARKDOWN = re.compile(r'(?<![\w*])\*\*(?=[^\s*])(.+?)(?<=[^\s*])\*\*(?![\w*])')
+
+def _clean_response(response_text: str) -> str:
+    moderated_text = response_text.strip()
+    # Verwijder eventuele ongewenste aanhalingstekens aan begin/eind
+    if moderated_text.startswith('"') and moderated_text.endswith('"'):
+        moderated_text = moderated_text[1:-1]
+    # Verwijder vetgedrukte markdown; maskering met sterretjes (i****t, *****) blijft staan
+    return BOLD_MARKDOWN.sub(r'\1', moderated_text)
+
+def _cache_key(post_content, previous_comments, current_comment_text, users_dict):
+    history = build_history(post_content, previous_comments, users_dict)
+    return history, moderation_cache.make_key(current_comment_text, history, f"{PROMPT_VERSION}:{backend.version}")
+
+class ModerationBatch:
+    """Meerdere reacties modereren met één model-aanroep (her-moderatie, zie src/remoderate.py).
+
+    Elke reactie houdt haar eigen context; de prompt vraagt om een JSON-lijst
+    met de resultaten in dezelfde volgorde. Reacties die de fast path nemen of
+    al in de cache staan gaan niet naar het model, en modelresultaten komen in
+    dezelfde cache als die van moderate_comment.
+
+    Anders dan moderate_comment valt een batch bij een fout niet terug op
+    lokale maskering: een reactie zonder resultaat krijgt None, zodat de
+    bestaande moderatie blijft staan en de reactie later opnieuw kan.
+
+    Args:
+        requests: Per reactie (post_content, previous_comments, current_comment_text).
+        users_dict: Dictionary die user IDs koppelt aan usernames.
+        store_results: False om modelresultaten niet in de cache te zetten (dry run).
+    """
+
+    def __init__(self, requests, users_dict: dict, store_results: bool = True):
+        self.results = [None] * len(requests) # Tekst per reactie, None zolang er geen resultaat is
+        self.outcomes = [None] * len(requests)
+        self.response_chars = 0
+        self.store_results = store_results
+        self._pending = [] # (positie, cache-sleutel) van de reacties in de prompt
+        items = []
+        for i, (post_content, previous_comments, current_comment_text) in enumerate(requests):
+            if is_trivially_compliant(current_comment_text):
+                moderation_cache.record_fast_path()
+                self.results[i], self.outcomes[i] = current_comment_text, 'fast_path'
+                continue
+            history, cache_key = _cache_key(post_content, previous_comments, current_comment_text, users_dict)
+            cached_text = moderation_cache.get(cache_key)
+            if cached_text is not None:
+                self.results[i], self.outcomes[i] = cached_text, 'cache_hit'
+                continue
+            self._pending.append((i, cache_key))
+            items.append((history, current_comment_text))
+        self.prompt = build_batch_prompt(items) if items else None
+
+    @property
+    def model_requests(self) -> int:
+        return len(self._pending)
+
+    def run(self) -> list:
+        """Roep het model aan als dat nodig is; geeft per reactie de tekst of None."""
+        if self.prompt is None:
+            return self.results
+        prompt_chars.observe(len(self.prompt))
+        try:
+            start = time.perf_counter()
+            response_text = moderation_client.call(self.prompt)
+            elapsed = time.perf_counter() - start
+        except CircuitOpenError:
+            return self._fail('breaker_open')
+        except Exception as e:
+            log_error('moderation_batch_failed', comments=len(self._pending), error_type=type(e).__name__, error=str(e)[:200])
+            return self._fail('error')
+        self.response_chars = len(response_text or '')
+        texts = _parse_batch_response(response_text, len(self._pending))
+        if texts is None:
+            log_warning('moderation_batch_invalid_response', comments=len(self._pending), response_chars=self.response_chars)
+            return self._fail('invalid_response')
+        for (i, cache_key), text in zip(self._pending, texts):
+            moderated_text = _clean_response(text) if isinstance(text, str) else ''
+            if not moderated_text:
+                self.outcomes[i] = 'empty_response'
+                continue
+            if self.store_results:
+                moderation_cache.put(cache_key, moderated_text, elapsed / len(self._pending))
+            self.results[i], self.outcomes[i] = moderated_text, 'model'
+        return self.results
+
+    def _fail(self, outcome):
+        for i, _ in self._pending:
+            self.outcomes[i] = outcome
+        return self.results
+
+def _parse_batch_response(response_text, count):
+    """De JSON-lijst uit een batch-antwoord, of None als die ontbreekt of niet klopt."""
+    if response_text is None:
+        return None
+    text = response_text.strip()
+    if text.startswith('```'): # Modellen zetten JSON graag in een codeblok
+        text = text.strip('`').removeprefix('json').strip()
+    try:
+        texts = json.loads(text)
+    except ValueError:
+        return None
+    return texts if isinstance(texts, list) and len(texts) == count else None
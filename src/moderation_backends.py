@@ -0,0 +1,156 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from src.moderation_prompt import BATCH_ITEM_HEADER, BATCH_RESPONSE_MARKER, CURRENT_COMMENT_MARKER, RESPONSE_MARKER
+from src.moderation_rules import mask_flagged_terms
+
+
+class ModerationBackend:
+    """Interface voor een model dat een moderatie-prompt beantwoordt.
+
+    generate() geeft de ruwe modeltekst terug, of None als het model geen
+    antwoord gaf (bv. door veiligheidsfilters). Fouten worden als exceptie
+    doorgegeven zodat de ResilientClient kan retryen.
+    """
+
+    name = 'base'
+
+    @property
+    def version(self) -> str:
+        """Identificatie van backend + model; onderdeel van de cache-sleutel."""
+        return self.name
+
+    def generate(self, prompt: str, timeout: float):
+        raise NotImplementedError
+
+
+class GeminiBackend(ModerationBackend):
+    """Google Gemini; de client wordt pas bij de eerste aanroep geconfigureerd."""
+
+    name = 'gemini'
+
+    generation_config = {
+        "temperature": 0.6,
+        "top_p": 1,
+        "top_k": 1,
+        "max_output_tokens": 2048,
+    }
+
+    safety_settings = [
+        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    ]
+
+    def __init__(self, model_name: str = "gemini-2.5-flash-preview-04-17", api_key: str = None):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        return f"{self.name}:{self.model_name}"
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai # Pas importeren als Gemini echt gebruikt wordt
+
+                # Laad de API-sleutel uit het .env bestand
+                api_key = self.api_key or os.getenv("GOOGLE_API_KEY")
+                if not api_key:
+                    raise ValueError("API sleutel niet gevonden. Zorg dat deze in het .env bestand staat als GOOGLE_API_KEY=jouw_sleutel")
+                genai.configure(api_key=api_key)
+                self._model = genai.GenerativeModel(model_name=self.model_name,
+                                                    generation_config=self.generation_config,
+                                                    safety_settings=self.safety_settings)
+            return self._model
+
+    def generate(self, prompt: str, timeout: float):
+        response = self._get_model().generate_content([prompt], request_options={"timeout": timeout})
+        return response.text if response.parts else None
+
+
+class FakeBackend(ModerationBackend):
+    """Deterministische lokale stand-in voor tests en load tests zonder netwerk.
+
+    Args:
+        latency: Vaste vertraging per aanroep in seconden (simuleert het model).
+        jitter: Extra willekeurige vertraging tussen 0 en `jitter` seconden.
+        mode: 'echo' geeft de reactie ongewijzigd terug, 'soften' maskeert
+            gemarkeerde woorden en voegt een open vraag toe.
+        failure_rate: Kans (0-1) dat een aanroep een fout geeft.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, mode: str = 'soften', failure_rate: float = 0.0, seed: int = None):
+        if mode not in ('echo', 'soften'):
+            raise ValueError(f"Onbekende modus voor de fake backend: {mode}")
+        self.latency = latency
+        self.jitter = jitter
+        self.mode = mode
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+
+    @property
+    def version(self) -> str:
+        return f"{self.name}:{self.mode}"
+
+    def generate(self, prompt: str, timeout: float):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(min(delay, timeout))
+            if delay > timeout:
+                raise TimeoutError(f"Fake backend: {delay:.2f}s overschrijdt timeout van {timeout:.2f}s")
+        if self.failure_rate and self._random.random() < self.failure_rate:
+            raise ConnectionError("Fake backend: gesimuleerde fout")
+
+        if prompt.endswith(BATCH_RESPONSE_MARKER):
+            return json.dumps([self._rewrite(text) for text in _batch_comments(prompt)], ensure_ascii=False)
+        return self._rewrite(_current_comment(prompt))
+
+    def _rewrite(self, text: str) -> str:
+        if self.mode == 'echo':
+            return text
+        softened = mask_flagged_terms(text)
+        return softened if softened.rstrip().endswith('?') else f"{softened} Wat bedoel je precies?"
+
+
+def _current_comment(prompt: str) -> str:
+    """Haal de te modereren reactie uit een prompt van build_prompt."""
+    start = prompt.rfind(CURRENT_COMMENT_MARKER)
+    text = prompt[start + len(CURRENT_COMMENT_MARKER):] if start != -1 else prompt
+    return text[:-len(RESPONSE_MARKER)] if text.endswith(RESPONSE_MARKER) else text
+
+
+_BATCH_ITEM = re.compile(re.escape(BATCH_ITEM_HEADER).replace(re.escape('{number}'), r'\d+'))
+
+
+def _batch_comments(prompt: str) -> list:
+    """Haal de te modereren reacties uit een prompt van build_batch_prompt."""
+    texts = []
+    for item in _BATCH_ITEM.split(prompt[:-len(BATCH_RESPONSE_MARKER)])[1:]:
+        start = item.rfind(CURRENT_COMMENT_MARKER)
+        texts.append(item[start + len(CURRENT_COMMENT_MARKER):-1]) # Zonder de afsluitende newline
+    return texts
+
+
+def create_backend(name: str) -> ModerationBackend:
+    """Maak de backend uit de configuratie ('gemini' of 'fake'); fake leest DIALINK_FAKE_* variabelen."""
+    if name == 'gemini':
+        return GeminiBackend(model_name=os.getenv("DIALINK_GEMINI_MODEL", "gemini-2.5-flash-preview-04-17"))
+    if name == 'fake':
+        return FakeBackend(
+            latency=float(os.getenv("DIALINK_FAKE_LATENCY", 0)),
+            jitter=float(os.getenv("DIALINK_FAKE_JITTER", 0)),
+            mode=os.getenv("DIALINK_FAKE_MODE", 'soften'),
+            failure_rate=float(os.getenv("DIALINK_FAKE_FAILURE_RATE", 0)),
+        )
+    raise ValueError(f"Onbekende moderatie backend: {name}")
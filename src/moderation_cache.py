@@ -0,0 +1,96 @@
+import collections
+import hashlib
+import sqlite3
+import threading
+import time
+
+from src.moderation_rules import normalize_comment
+
+
+class ModerationCache:
+    """LRU/TTL cache voor moderatie-resultaten, optioneel met een tier op schijf.
+
+    De sleutel bestaat uit de genormaliseerde reactie, een digest van de
+    context en de prompt/model versie, zodat een nieuwe prompt of een ander
+    model automatisch nieuwe resultaten oplevert.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 7 * 24 * 3600, disk_path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = collections.OrderedDict() # sleutel -> (tekst, opgeslagen_op)
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self._disk.execute("CREATE TABLE IF NOT EXISTS moderation_cache (key TEXT PRIMARY KEY, text TEXT NOT NULL, stored_at REAL NOT NULL)")
+            self._disk.commit()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._fast_path = 0
+        self._model_calls = 0
+        self._model_seconds = 0.0
+
+    @staticmethod
+    def make_key(comment_text: str, context: str, version: str) -> str:
+        context_digest = hashlib.sha256(context.encode('utf-8')).hexdigest()
+        raw = '\x1f'.join((version, context_digest, normalize_comment(comment_text)))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key] # Verlopen
+            if self._disk is not None:
+                row = self._disk.execute("SELECT text, stored_at FROM moderation_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    self._store_memory(key, row[0], row[1])
+                    self._hits += 1
+                    self._disk_hits += 1
+                    return row[0]
+            self._misses += 1
+            return None
+
+    def put(self, key: str, text: str, model_seconds: float):
+        """Sla een resultaat op, samen met de tijd die de AI-aanroep kostte."""
+        now = time.time()
+        with self._lock:
+            self._model_calls += 1
+            self._model_seconds += model_seconds
+            self._store_memory(key, text, now)
+            if self._disk is not None:
+                self._disk.execute("INSERT OR REPLACE INTO moderation_cache (key, text, stored_at) VALUES (?, ?, ?)", (key, text, now))
+                self._disk.commit()
+
+    def _store_memory(self, key, text, stored_at):
+        self._entries[key] = (text, stored_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False) # Minst recent gebruikt eruit
+
+    def record_fast_path(self):
+        with self._lock:
+            self._fast_path += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            avg_model_seconds = self._model_seconds / self._model_calls if self._model_calls else 0.0
+            return {
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'fast_path': self._fast_path,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else 0.0,
+                'avg_model_seconds': round(avg_model_seconds, 3),
+                # Geschatte bespaarde tijd: elke hit of fast path scheelt een gemiddelde AI-aanroep
+                'seconds_saved': round((self._hits + self._fast_path) * avg_model_seconds, 1),
+            }
@@ -0,0 +1,145 @@
+import bisect
+import os
+
+from src.models import Comment
+
+# Verhoog bij elke inhoudelijke wijziging van de prompt: oude cache-resultaten vervallen dan
+PROMPT_VERSION = "1"
+
+# Budget voor de gesprekscontext in de prompt (in tekens, ~4 tekens per token)
+CONTEXT_CHAR_BUDGET = int(os.getenv("DIALINK_CONTEXT_CHARS", 4000))
+MAX_POST_CHARS = 1500 # De originele post wordt hierop afgekapt
+MAX_COMMENT_CHARS = 500 # Elke reactie in de context wordt hierop afgekapt
+MAX_SIBLINGS = 5 # Aantal meest recente reacties op hetzelfde niveau
+MAX_ANCESTORS = 10 # Zo ver lopen we maximaal omhoog in een diepe reply-keten
+
+# Label vóór de te modereren reactie (de lokale fake backend zoekt hierop)
+CURRENT_COMMENT_MARKER = "Nieuwste reactie om te beoordelen en eventueel te herschrijven: "
+RESPONSE_MARKER = "\n\nHerschreven nieuwste reactie:"
+
+# Batch-prompt (her-moderatie): meerdere gesprekken in één aanroep, antwoord als JSON-lijst
+BATCH_ITEM_HEADER = "\n=== Gesprek {number} ===\n"
+BATCH_RESPONSE_MARKER = "\n\nJSON-lijst met de herschreven nieuwste reacties:"
+
+PROMPT_INSTRUCTIONS = """Je bent de **Dialink‑Moderator**, een AI‑filter dat uitsluitend de LAATSTE inzending in een gesprek herschrijft om er een waardige dialoog‑bijdrage van te maken.
+
+### Doel
+Stimuleer begrip, nieuwsgierigheid en samenwerking; voorkom ruzie, spot of minachting.
+
+### Werkwijze
+1. **Veiligheid & respect**
+   • Verwijder elke vorm van haat, bedreiging, schelden of vernedering.
+2. **Behoud kerninformatie**
+   • Laat de feitelijke inhoud, emoties en intentie intact; voeg niets inhoudelijks toe dat er niet was.
+3. **Empathische herformulering**
+   • Vervang "jij‑beschuldigingen" door neutrale observaties of ik‑boodschappen.
+   • Benoem het onderliggende gevoel of belang ("Het klinkt alsof…", "Ik merk dat…").
+4. **Dialoog‑boost**
+   • Sluit af met ÉÉN open, uitnodigende vraag die de ander ruimte geeft om verder te vertellen
+     (bv. "Hoe voelde dat voor jou?", "Wat betekent dat voor je?", "Wat zou je graag willen?").
+5. **Taal & lengte**
+   • Schrijf in dezelfde taal als de originele reactie.
+   • Houd de lengte ongeveer gelijk of iets langer (max. +40 %), zodat de nuance behouden blijft.
+6. **Output‑formaat**
+   • Geef UITSLUITEND de (eventueel herschreven) tekst van de nieuwste reactie terug,
+     zonder aanhalingstekens, markdown of uitleg.
+   • Als de originele reactie al volledig voldoet aan alle bovenstaande punten, stuur die ongewijzigd terug.
+
+"""
+
+BATCH_INSTRUCTIONS = """### Meerdere gesprekken
+Hieronder volgen {count} losse gesprekken, elk met een eigen nieuwste reactie. Beoordeel elke
+nieuwste reactie afzonderlijk volgens de werkwijze hierboven, alleen met de context van haar eigen gesprek.
+In plaats van het output‑formaat hierboven: geef UITSLUITEND een JSON‑lijst met precies {count} strings
+terug, de (eventueel herschreven) nieuwste reacties in dezelfde volgorde, zonder markdown of uitleg.
+"""
+
+
+def select_context_comments(post, parent_comment: Comment, find_comment, exclude: Comment = None,
+                            max_siblings: int = MAX_SIBLINGS, before: Comment = None) -> list[Comment]:
+    """Kies de relevante context voor een nieuwe reactie.
+
+    Args:
+        post: De Post waaronder gereageerd wordt.
+        parent_comment: De comment waarop gereageerd wordt (None voor top-level).
+        find_comment: Functie die een comment ID omzet naar een Comment.
+        exclude: De nieuwe reactie zelf, die niet in zijn eigen context hoort.
+        max_siblings: Maximaal aantal recente reacties op hetzelfde niveau.
+        before: Alleen siblings die ouder zijn dan deze reactie (her-moderatie:
+            de context zoals die was toen de reactie geplaatst werd).
+
+    Returns:
+        Ancestors (de keten tot de top-level comment) gevolgd door de meest
+        recente siblings, in prioriteitsvolgorde: dichtstbijzijnde eerst.
+    """
+    ancestors = []
+    current = parent_comment
+    while current is not None and len(ancestors) < MAX_ANCESTORS:
+        ancestors.append(current)
+        current = find_comment(current.parent_comment_id) if current.parent_comment_id else None
+
+    siblings_source = parent_comment.replies if parent_comment is not None else post.comments
+    end = len(siblings_source)
+    if before is not None:
+        # Siblings staan op volgorde van plaatsing
+        end = bisect.bisect_left(siblings_source, before.timestamp_us, key=lambda c: c.timestamp_us)
+    siblings = []
+    # Van achter naar voren: alleen de laatste paar reacties bekijken, ongeacht de threadgrootte
+    for i in range(end - 1, -1, -1):
+        if len(siblings) >= max_siblings:
+            break
+        comment = siblings_source[i]
+        if comment is not exclude:
+            siblings.append(comment)
+    return ancestors + siblings
+
+
+def build_history(post_content: str, context_comments: list[Comment], users_dict: dict,
+                  budget: int = CONTEXT_CHAR_BUDGET) -> str:
+    """Bouw de gespreksgeschiedenis binnen een vast tekenbudget.
+
+    Comments worden in de gegeven (prioriteits)volgorde toegevoegd tot het
+    budget op is en daarna chronologisch weergegeven.
+    """
+    lines = []
+    used = 0
+    for comment in context_comments:
+        username = users_dict.get(comment.user_id, 'Onbekende Gebruiker')
+        line = f"{username}: {_truncate(comment.moderated_content, MAX_COMMENT_CHARS)}"
+        if used + len(line) > budget:
+            break
+        lines.append((comment.timestamp, line))
+        used += len(line)
+    lines.sort(key=lambda item: item[0])
+
+    parts = [f"Originele Post:\n{_truncate(post_content, MAX_POST_CHARS)}\n\n---\nReacties:\n"]
+    if not lines:
+        parts.append("(Nog geen eerdere reacties)\n")
+    for i, (_, line) in enumerate(lines):
+        parts.append(f"{i+1}. {line}\n")
+    parts.append("\n---")
+    return "".join(parts)
+
+
+def build_prompt(history: str, current_comment_text: str) -> str:
+    """Stel de volledige moderatie-prompt in één keer samen (history uit build_history)."""
+    return "".join((
+        PROMPT_INSTRUCTIONS,
+        history,
+        "\n", CURRENT_COMMENT_MARKER,
+        current_comment_text,
+        RESPONSE_MARKER,
+    ))
+
+
+def build_batch_prompt(items) -> str:
+    """Eén prompt voor meerdere reacties; items zijn (history, current_comment_text) paren."""
+    parts = [PROMPT_INSTRUCTIONS, BATCH_INSTRUCTIONS.format(count=len(items))]
+    for number, (history, current_comment_text) in enumerate(items, 1):
+        parts += (BATCH_ITEM_HEADER.format(number=number), history, "\n", CURRENT_COMMENT_MARKER, current_comment_text, "\n")
+    parts.append(BATCH_RESPONSE_MARKER)
+    return "".join(parts)
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "…"
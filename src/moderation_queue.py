@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+
+from src.log import log_error
+
+
+class ModerationQueueFull(Exception):
+    """De wachtrij zit vol; de aanroeper moet het later opnieuw proberen."""
+
+
+class ModerationJob:
+    def __init__(self, comment_id: str, moderation_args: dict):
+        self.comment_id = comment_id
+        self.moderation_args = moderation_args # Keyword-argumenten voor moderate_comment
+        self.enqueued_at = time.monotonic()
+
+
+class ModerationQueue:
+    """Begrensde wachtrij met een pool van worker threads voor moderatie.
+
+    Requests plaatsen een job en gaan direct verder; de workers roepen
+    `moderate` aan (met maximaal `worker_count` gelijktijdige aanroepen) en
+    geven het resultaat aan `on_result(comment_id, moderated_text)`.
+    Als er al `max_pending` jobs wachten, weigert submit() nieuwe jobs
+    (back-pressure) in plaats van het geheugen of de API te overspoelen.
+    """
+
+    def __init__(self, moderate, on_result, worker_count: int = 4, max_pending: int = 200):
+        self.moderate = moderate
+        self.on_result = on_result
+        self.worker_count = worker_count
+        self.max_pending = max_pending
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._workers = []
+        self._in_flight = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_wait_seconds = 0.0
+
+    def _ensure_started(self):
+        # Threads pas starten bij het eerste gebruik: bij gunicorn --preload
+        # zouden threads uit het master-proces niet meegaan naar de workers.
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._run, name=f"moderation-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def full(self) -> bool:
+        return self._jobs.full()
+
+    def submit(self, job: ModerationJob, timeout: float = 0.5):
+        """Plaats een job; wacht maximaal `timeout` seconden (None = onbeperkt) op ruimte."""
+        self._ensure_started()
+        try:
+            self._jobs.put(job, timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise ModerationQueueFull()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            with self._lock:
+                self._in_flight += 1
+                self._total_wait_seconds += time.monotonic() - job.enqueued_at
+            try:
+                moderated_text = self.moderate(**job.moderation_args)
+                failed = False
+            except Exception as e:
+                # moderate_comment vangt zelf al fouten af; dit is een laatste vangnet
+                log_error('moderation_job_failed', comment_id=job.comment_id, error=str(e))
+                moderated_text = job.moderation_args.get('current_comment_text')
+                failed = True
+            try:
+                self.on_result(job.comment_id, moderated_text)
+            except Exception as e:
+                log_error('moderation_result_failed', comment_id=job.comment_id, error=str(e))
+                failed = True
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._processed += 1
+                    self._failed += failed
+                self._jobs.task_done()
+
+    def stats(self) -> dict:
+        """Huidige wachtrij-diepte en tellers, bv. voor monitoring."""
+        with self._lock:
+            started = self._processed + self._in_flight
+            return {
+                'pending': self._jobs.qsize(),
+                'in_flight': self._in_flight,
+                'max_pending': self.max_pending,
+                'workers': self.worker_count,
+                'processed': self._processed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'avg_wait_seconds': round(self._total_wait_seconds / started, 3) if started else 0.0,
+            }
@@ -0,0 +1,42 @@
+import re
+
+# Alleen deze vaste, onschuldige reacties slaan de AI over (na normalisatie, zonder leestekens en emoji)
+HARMLESS_PHRASES = {
+    'bedankt', 'dank je', 'dank je wel', 'dankjewel', 'dank u', 'dank u wel', 'merci',
+    'thanks', 'thank you', 'thx', 'ty', '+1', 'eens', 'mee eens', 'helemaal mee eens', 'agreed',
+    'goed gezegd', 'well said', 'top', 'mooi', 'leuk', 'nice', 'great', 'cool',
+    'haha', 'hahaha', 'lol', 'ok', 'oké', 'oke', 'ja', 'yes',
+}
+SYMBOLS_ONLY_CHARS = 40 # Reacties van alleen emoji/leestekens tot deze lengte slaan de AI ook over
+
+# Woorden die de lokale fallback maskeert als de moderator niet bereikbaar is
+FLAGGED_TERMS = {
+    'achterlijk', 'debiel', 'dom', 'dombo', 'haat', 'hoer', 'idioot', 'kanker', 'klootzak', 'kut',
+    'lul', 'mongool', 'rot', 'stom', 'stomme', 'sukkel', 'tering', 'tyfus', 'zak',
+    'idiot', 'stupid', 'hate', 'shut', 'moron', 'loser', 'fuck', 'shit',
+}
+
+_WHITESPACE = re.compile(r'\s+')
+_NOT_PHRASE = re.compile(r'[^\w+ ]+') # Leestekens en emoji rond een zin
+_FLAGGED_PATTERN = re.compile(r'\b(' + '|'.join(sorted(FLAGGED_TERMS)) + r')\b', re.IGNORECASE)
+
+
+def normalize_comment(text: str) -> str:
+    """Normaliseer tekst voor de cache: kleine letters en samengevoegde witruimte."""
+    return _WHITESPACE.sub(' ', text.casefold()).strip()
+
+
+def is_trivially_compliant(text: str) -> bool:
+    """Bekende onschuldige reacties ("thanks!", "+1 👍") en pure emoji hoeven niet naar de AI.
+
+    Een allowlist: alles wat hier niet onder valt gaat via de cache of het model.
+    """
+    normalized = normalize_comment(text)
+    if not any(char.isalnum() for char in normalized):
+        return len(normalized) <= SYMBOLS_ONLY_CHARS
+    return _WHITESPACE.sub(' ', _NOT_PHRASE.sub(' ', normalized)).strip() in HARMLESS_PHRASES
+
+
+def mask_flagged_terms(text: str) -> str:
+    """Goedkope lokale moderatie: vervang gemarkeerde woorden door sterretjes."""
+    return _FLAGGED_PATTERN.sub(lambda match: '*' * len(match.group(0)), text)
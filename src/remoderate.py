@@ -0,0 +1,331 @@
+"""Her-moderatie van opgeslagen reacties, bv. nadat de moderatie-prompt gewijzigd is.
+
+Gebruik (vanuit de hoofdmap van het project, gerust naast de draaiende app):
+
+    python -m src.remoderate --dry-run
+    python -m src.remoderate --batch-size 8 --concurrency 4
+    python -m src.remoderate --since 2025-01-01 --limit 10000
+
+Het script doet mee als extra worker van de app: het gebruikt dezelfde opslag
+(DIALINK_STORAGE, DIALINK_DATABASE) en moderatie-backend
+(DIALINK_MODERATION_BACKEND), neemt wijzigingen van de app over en schrijft
+de resultaten per batch weg als gewone update_comment-records. Draaiende
+workers verwerken die bij hun volgende request als delta; de storage-lock
+wordt per batch maar even vastgehouden. Compacteren laat het script aan de
+app over.
+
+Gepubliceerde reacties worden van oud naar nieuw afgewerkt, `--batch-size`
+per model-aanroep en maximaal `--concurrency` aanroepen tegelijk. Elke
+reactie krijgt de context van het moment waarop ze geplaatst werd. Een
+reactie zonder resultaat (fout of ongeldig antwoord) houdt haar huidige tekst.
+
+Het checkpoint onthoudt tot welke reactie alles opgeslagen is en welke
+reacties mislukten; opnieuw starten gaat daar verder, mislukte reacties
+eerst. Na een wijziging van PROMPT_VERSION of de backend begint het script
+automatisch opnieuw.
+
+Met --dry-run wordt niets opgeslagen, ook niet in de moderatie-cache. Een
+steekproef gaat langs het model
+voor het aandeel reacties dat zou veranderen; voor de hele selectie worden
+de prompts opgebouwd om het aantal tokens (en met --input-price en
+--output-price de kosten) te schatten.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import os
+import random
+import time
+
+from src.index import DataIndex
+from src.models import COMMENT_PUBLISHED, ONE_MICROSECOND, TIMESTAMP_EPOCH
+from src.moderation import ModerationBatch, backend
+from src.moderation_prompt import PROMPT_VERSION, select_context_comments
+from src.storage import ReplayState, create_storage
+
+CHARS_PER_TOKEN = 4 # Zelfde vuistregel als het contextbudget van de prompt
+DEFAULT_OUTPUT_RATIO = 1.2 # Antwoord t.o.v. de originele reactie, als er geen steekproef is
+PROGRESS_INTERVAL = 10.0 # Seconden tussen voortgangsregels
+
+
+class Dataset:
+    """De data in het geheugen, bijgewerkt met de wijzigingen van de app (zoals een worker)."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        storage.set_change_handler(lambda op, data: self.replay.apply(op, data))
+        self.load()
+
+    def load(self):
+        self.users, self.posts = self.storage.load()
+        self.index = DataIndex()
+        self.index.rebuild(self.users, self.posts)
+        self.replay = ReplayState(self.users, self.posts, index=self.index)
+
+    def refresh(self):
+        """Neem de wijzigingen van de app over; bij te grote achterstand opnieuw laden."""
+        if self.storage.has_changes() and not self.storage.refresh():
+            self.load()
+
+    def published_comments(self, keys):
+        """Zoek de reacties bij (tijd, id) sleutels op; verdwenen of niet gepubliceerde vallen af."""
+        comments = (self.index.comment(comment_id) for _, comment_id in keys)
+        return [c for c in comments if c is not None and c.status == COMMENT_PUBLISHED]
+
+    def moderation_request(self, comment):
+        """(post_content, previous_comments, current_comment_text) met de context van toen."""
+        post = self.index.post(comment.post_id)
+        parent = self.index.comment(comment.parent_comment_id) if comment.parent_comment_id else None
+        previous_comments = select_context_comments(post, parent, self.index.comment, exclude=comment, before=comment)
+        return post.content, previous_comments, comment.original_content
+
+    def prepare(self, comments, store_results=True):
+        return ModerationBatch([self.moderation_request(c) for c in comments], self.index.usernames, store_results)
+
+
+def open_storage():
+    """Dezelfde storage als de app (zie app.py)."""
+    if os.environ.get('DIALINK_STORAGE', 'json') == 'sqlite':
+        return create_storage('sqlite', os.environ.get('DIALINK_DATABASE', 'data.db'))
+    return create_storage('json', 'data.json', compact_threshold=int(os.environ.get('DIALINK_COMPACT_THRESHOLD', 500)),
+                          snapshot_format=os.environ.get('DIALINK_SNAPSHOT_FORMAT', 'binary'))
+
+
+# --- Checkpoint ---
+
+def moderation_version() -> str:
+    return f"{PROMPT_VERSION}:{backend.version}"
+
+
+def load_checkpoint(path: str, restart: bool) -> dict:
+    """Cursor (tijd, id) van de laatst opgeslagen reactie en de mislukte reacties."""
+    fresh = {'version': moderation_version(), 'cursor': None, 'failed': []}
+    if restart or not os.path.exists(path):
+        return fresh
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('version') != fresh['version']:
+        print(f"Checkpoint hoort bij moderatieversie {checkpoint.get('version')}; opnieuw beginnen met {fresh['version']}")
+        return fresh
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path) # Atomisch: een onderbreking laat het vorige checkpoint heel
+
+
+def select_keys(dataset: Dataset, since_us: int, cursor, limit: int):
+    """(tijd, id) van de gepubliceerde reacties na de cursor, oudste eerst."""
+    cursor = tuple(cursor) if cursor else None
+    keys = sorted((c.timestamp_us, c.id) for c in dataset.index.comments_by_id.values()
+                  if c.status == COMMENT_PUBLISHED and c.timestamp_us >= since_us
+                  and (cursor is None or (c.timestamp_us, c.id) > cursor))
+    return keys[:limit] if limit else keys
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# --- Uitvoeren ---
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.processed = 0
+        self.changed = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._reported = self.started
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        rate = self.processed / max(now - self.started, 1e-9)
+        print(f"{self.processed}/{self.total} reacties, {self.changed} gewijzigd, {self.failed} mislukt ({rate:.1f}/s)")
+
+
+def remoderate(dataset: Dataset, checkpoint: dict, checkpoint_path: str, since_us: int, limit: int,
+               batch_size: int, concurrency: int, max_failed_batches: int) -> Progress:
+    """Modereer opnieuw en sla per batch op. Geeft de tellers van deze run terug."""
+    failed = set(checkpoint['failed'])
+    retry_keys = sorted((c.timestamp_us, c.id) for c in dataset.published_comments((None, i) for i in failed))
+    fresh_keys = select_keys(dataset, since_us, checkpoint['cursor'], limit)
+    # Mislukte reacties eerst; alleen de nieuwe batches schuiven de cursor op
+    batches = [(keys, False) for keys in chunks(retry_keys, batch_size)] + \
+              [(keys, True) for keys in chunks(fresh_keys, batch_size)]
+    progress = Progress(len(retry_keys) + len(fresh_keys))
+    print(f"{len(fresh_keys)} reacties te doen, {len(retry_keys)} opnieuw na een fout, "
+          f"in {len(batches)} batches (moderatieversie {checkpoint['version']})")
+
+    finished = set() # Nummers van opgeslagen batches die nog niet in de cursor zitten
+    next_unfinished = 0
+    consecutive_failures = 0
+    stopping = False
+    in_flight = {}
+    next_batch = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while in_flight or (next_batch < len(batches) and not stopping):
+            while next_batch < len(batches) and len(in_flight) < concurrency and not stopping:
+                dataset.refresh()
+                comments = dataset.published_comments(batches[next_batch][0])
+                batch = dataset.prepare(comments) # Context lezen gebeurt alleen in deze thread
+                in_flight[pool.submit(batch.run)] = (next_batch, [c.id for c in comments], batch)
+                next_batch += 1
+            try:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                print("Onderbroken: lopende batches worden nog opgeslagen...")
+                stopping = True
+                continue
+            for future in done:
+                number, comment_ids, batch = in_flight.pop(future)
+                batch_failures = commit_batch(dataset, comment_ids, future.result(), failed, progress)
+                if batch.model_requests and batch_failures == batch.model_requests:
+                    consecutive_failures += 1
+                else:
+                    consecutive_failures = 0
+                # De cursor schuift alleen op over een aaneengesloten reeks opgeslagen batches
+                finished.add(number)
+                while next_unfinished in finished:
+                    finished.discard(next_unfinished)
+                    keys, moves_cursor = batches[next_unfinished]
+                    if moves_cursor and keys:
+                        checkpoint['cursor'] = list(keys[-1])
+                    next_unfinished += 1
+                checkpoint['failed'] = sorted(failed)
+                save_checkpoint(checkpoint_path, checkpoint)
+                progress.report()
+            if consecutive_failures >= max_failed_batches and not stopping:
+                print(f"{consecutive_failures} batches op rij mislukt: gestopt. Start later opnieuw om verder te gaan.")
+                stopping = True
+    progress.report(force=True)
+    return progress
+
+
+def commit_batch(dataset: Dataset, comment_ids, results, failed: set, progress: Progress) -> int:
+    """Sla de gewijzigde reacties van één batch in één keer op. Geeft het aantal mislukte terug."""
+    dataset.refresh()
+    changed = []
+    failures = 0
+    for comment_id, moderated_text in zip(comment_ids, results):
+        progress.processed += 1
+        if moderated_text is None:
+            failed.add(comment_id)
+            failures += 1
+            continue
+        failed.discard(comment_id)
+        comment = dataset.index.comment(comment_id)
+        if comment is None or comment.status != COMMENT_PUBLISHED:
+            continue
+        if moderated_text != comment.moderated_content:
+            comment.moderated_content = moderated_text
+            changed.append(comment)
+    if changed:
+        dataset.storage.update_comments(changed)
+    progress.changed += len(changed)
+    progress.failed += failures
+    return failures
+
+
+def dry_run(dataset: Dataset, since_us: int, limit: int, batch_size: int, concurrency: int, sample_size: int,
+            seed: int, input_price: float, output_price: float):
+    """Schat tokens en kosten voor de hele selectie en meet het aandeel wijzigingen in een steekproef."""
+    keys = select_keys(dataset, since_us, None, limit)
+    outcomes = {}
+    prompt_chars = 0
+    model_calls = 0
+    model_comment_chars = 0
+    for batch_keys in chunks(keys, batch_size):
+        comments = dataset.published_comments(batch_keys)
+        batch = dataset.prepare(comments)
+        for comment, outcome in zip(comments, batch.outcomes):
+            outcome = outcome or 'model'
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == 'model':
+                model_comment_chars += len(comment.original_content)
+        if batch.prompt is not None:
+            prompt_chars += len(batch.prompt)
+            model_calls += 1
+
+    sample = sorted(random.Random(seed).sample(keys, min(sample_size, len(keys))))
+    changed = failed = sample_response_chars = sample_comment_chars = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        prepared = []
+        for batch_keys in chunks(sample, batch_size):
+            comments = dataset.published_comments(batch_keys)
+            batch = dataset.prepare(comments, store_results=False) # Een dry run laat de cache ongemoeid
+            prepared.append((comments, batch, pool.submit(batch.run)))
+        for comments, batch, future in prepared:
+            for comment, moderated_text, outcome in zip(comments, future.result(), batch.outcomes):
+                if moderated_text is None:
+                    failed += 1
+                elif moderated_text != comment.moderated_content:
+                    changed += 1
+                if outcome == 'model':
+                    sample_comment_chars += len(comment.original_content)
+            sample_response_chars += batch.response_chars
+
+    output_ratio = sample_response_chars / sample_comment_chars if sample_comment_chars else DEFAULT_OUTPUT_RATIO
+    input_tokens = prompt_chars / CHARS_PER_TOKEN
+    output_tokens = model_comment_chars * output_ratio / CHARS_PER_TOKEN
+    answered = len(sample) - failed
+    print(f"Selectie: {len(keys)} gepubliceerde reacties; naar het model: {outcomes.get('model', 0)} "
+          f"in {model_calls} aanroepen (fast path {outcomes.get('fast_path', 0)}, cache {outcomes.get('cache_hit', 0)})")
+    print(f"Steekproef: {len(sample)} reacties, {changed} gewijzigd "
+          f"({changed / answered:.1%} van de beantwoorde), {failed} mislukt" if answered else
+          f"Steekproef: {len(sample)} reacties, geen resultaten")
+    print(f"Geschatte tokens: {input_tokens / 1e6:.2f}M input, {output_tokens / 1e6:.2f}M output "
+          f"(~{CHARS_PER_TOKEN} tekens per token, antwoord {output_ratio:.2f}x de reactie)")
+    if input_price or output_price:
+        cost = input_tokens / 1e6 * input_price + output_tokens / 1e6 * output_price
+        print(f"Geschatte kosten: {cost:.2f} (input {input_price}/M, output {output_price}/M tokens)")
+
+
+def parse_since(value: str) -> int:
+    """Datum of tijdstip (ISO) als microseconden, zoals Comment.timestamp_us."""
+    return (datetime.datetime.fromisoformat(value) - TIMESTAMP_EPOCH) // ONE_MICROSECOND
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modereer opgeslagen reacties opnieuw, in batches en hervatbaar.")
+    parser.add_argument('--batch-size', type=int, default=8, help="Reacties per model-aanroep")
+    parser.add_argument('--concurrency', type=int, default=4, help="Maximaal aantal model-aanroepen tegelijk")
+    parser.add_argument('--since', type=parse_since, default=None, help="Alleen reacties vanaf deze datum (ISO)")
+    parser.add_argument('--limit', type=int, default=0, help="Maximaal aantal (nieuwe) reacties in deze run")
+    parser.add_argument('--checkpoint', default='remoderate.checkpoint.json', help="Bestand met de voortgang")
+    parser.add_argument('--restart', action='store_true', help="Negeer het checkpoint en begin vooraan")
+    parser.add_argument('--max-failed-batches', type=int, default=5,
+                        help="Stop na zoveel volledig mislukte batches op rij (bv. model onbereikbaar)")
+    parser.add_argument('--dry-run', action='store_true', help="Niets opslaan; schat wijzigingen, tokens en kosten")
+    parser.add_argument('--sample', type=int, default=200, help="Dry run: aantal reacties dat echt langs het model gaat")
+    parser.add_argument('--seed', type=int, default=0, help="Dry run: seed voor de steekproef")
+    parser.add_argument('--input-price', type=float, default=0.0, help="Dry run: prijs per miljoen input-tokens")
+    parser.add_argument('--output-price', type=float, default=0.0, help="Dry run: prijs per miljoen output-tokens")
+    args = parser.parse_args()
+    if args.batch_size < 1 or args.concurrency < 1:
+        parser.error("--batch-size en --concurrency moeten minstens 1 zijn")
+
+    dataset = Dataset(open_storage())
+    since_us = args.since if args.since is not None else -1 << 62 # Standaard: alles
+    if args.dry_run:
+        dry_run(dataset, since_us, args.limit, args.batch_size, args.concurrency, args.sample, args.seed,
+                args.input_price, args.output_price)
+        return
+
+    checkpoint = load_checkpoint(args.checkpoint, args.restart)
+    start = time.monotonic()
+    progress = remoderate(dataset, checkpoint, args.checkpoint, since_us, args.limit, args.batch_size,
+                          args.concurrency, args.max_failed_batches)
+    print(f"Klaar: {progress.processed} reacties in {time.monotonic() - start:.1f} s, {progress.changed} gewijzigd, "
+          f"{len(checkpoint['failed'])} nog mislukt (checkpoint: {args.checkpoint})")
+
+
+if __name__ == "__main__":
+    main()
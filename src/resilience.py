@@ -0,0 +1,132 @@
+import random
+import threading
+import time
+
+from src.metrics import Histogram
+
+
+class CircuitOpenError(Exception):
+    """De upstream wordt als ongezond beschouwd; de aanroep is niet uitgevoerd."""
+
+
+class CircuitBreaker:
+    """Klassieke circuit breaker: closed -> open na herhaalde fouten -> half-open proefaanroep.
+
+    Zolang de breaker open staat falen aanroepen direct (fast-fail), zodat
+    workers niet blijven wachten op een trage of onbereikbare API.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2} # Numeriek voor /metrics
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold # Opeenvolgende fouten voordat de breaker opent
+        self.reset_timeout = reset_timeout # Seconden open voordat een proefaanroep mag
+        self.state = self.CLOSED
+        self.times_opened = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True # Precies één proefaanroep tegelijk
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class ResilientClient:
+    """Wrapper rond een upstream-aanroep met deadline, retries met jitter en een circuit breaker.
+
+    `call_fn(*args, timeout=...)` moet zelf de per-aanroep timeout respecteren
+    (bv. via request_options van de Gemini client). De totale tijd over alle
+    pogingen heen wordt begrensd door `deadline`.
+    """
+
+    def __init__(self, call_fn, timeout: float = 10.0, deadline: float = 20.0, max_retries: int = 2,
+                 backoff_base: float = 0.25, backoff_max: float = 2.0, breaker: CircuitBreaker = None):
+        self.call_fn = call_fn
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = Histogram()
+        self._lock = threading.Lock()
+        self._successes = 0
+        self._failures = 0
+        self._retries = 0
+        self._rejected = 0
+
+    def call(self, *args):
+        if not self.breaker.allow():
+            with self._lock:
+                self._rejected += 1
+            raise CircuitOpenError("Circuit breaker staat open")
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            remaining = self.deadline - (time.monotonic() - started)
+            attempt_start = time.monotonic()
+            try:
+                result = self.call_fn(*args, timeout=min(self.timeout, max(remaining, 0.1)))
+            except Exception:
+                self.latency.observe(time.monotonic() - attempt_start)
+                with self._lock:
+                    self._failures += 1
+                # "Full jitter": willekeurige wachttijd tussen 0 en de exponentiële backoff
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                elapsed = time.monotonic() - started
+                if attempt >= self.max_retries or elapsed + delay >= self.deadline:
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                time.sleep(delay)
+                continue
+            self.latency.observe(time.monotonic() - attempt_start)
+            with self._lock:
+                self._successes += 1
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'breaker_state': self.breaker.state,
+                'breaker_state_code': CircuitBreaker.STATE_CODES[self.breaker.state],
+                'breaker_opened': self.breaker.times_opened,
+                'successes': self._successes,
+                'failures': self._failures,
+                'retries': self._retries,
+                'rejected_open': self._rejected,
+                'latency_seconds': self.latency.snapshot(),
+            }
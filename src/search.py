@@ -0,0 +1,197 @@
+"""Full-text zoeken in posts en gepubliceerde reacties.
+
+Een inverted index in het geheugen: per term een gesorteerde array met
+postings (documentnummer << 4 | termfrequentie, maximaal 15), of één getal
+voor termen die maar in één document voorkomen. Documenten krijgen
+oplopende nummers in volgorde van toevoegen (bij rebuild: op tijd), zodat
+het einde van elke postinglijst de nieuwste treffers bevat.
+
+Een zoekopdracht zoekt documenten die alle termen bevatten (AND), begint
+bij de zeldzaamste term en rangschikt met BM25. Voor zeer algemene termen
+worden alleen de nieuwste `max_candidates` treffers gerangschikt; zo blijft
+een zoekopdracht ook bij miljoenen reacties binnen enkele milliseconden.
+"""
+import array
+import bisect
+import collections
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+from src.models import Post, Comment, COMMENT_PUBLISHED
+
+_TERM = re.compile(r'\b\w{2,40}\b') # Losse tekens en extreem lange woorden tellen niet mee
+MAX_QUERY_TERMS = 8
+FREQUENCY_BITS = 4 # Termfrequentie in de onderste bits van een posting
+MAX_FREQUENCY = (1 << FREQUENCY_BITS) - 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Te algemeen om op te zoeken; ze weglaten scheelt ook veel geheugen
+STOPWORDS = frozenset("""
+de het een en van ik je jij u we wij ze zij hij het is zijn was waren ben bent
+in op aan te met voor niet dat die dit er maar om ook als dan bij of naar uit
+nog wel geen al zo kan wat wie hoe waar door over tot mijn jouw hun haar
+the a an and or of to in on at is are was were be it this that for with not
+""".split())
+
+SearchPage = collections.namedtuple('SearchPage', 'hits total truncated')
+
+
+def _normalize(text: str) -> str:
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return text.casefold()
+
+
+def tokenize(text: str):
+    """Termen uit een tekst: kleine letters, zonder accenten en stopwoorden."""
+    return [term for term in _TERM.findall(_normalize(text)) if term not in STOPWORDS]
+
+
+class SearchIndex:
+    """Incrementele inverted index over posts en gepubliceerde reacties.
+
+    Bijwerken gebeurt bij elke nieuwe post en elke gepubliceerde reactie;
+    een reactie die opnieuw gemodereerd wordt vervangt zijn oude document.
+    Vervangen documenten blijven als 'dood' nummer in de postings staan tot
+    de volgende rebuild.
+
+    Args:
+        max_candidates: Maximaal aantal (nieuwste) treffers dat per
+            zoekopdracht gerangschikt wordt.
+    """
+
+    def __init__(self, max_candidates: int = 2000):
+        self.max_candidates = max_candidates
+        self._lock = threading.Lock()
+        self._reset()
+        self.queries = 0
+
+    def _reset(self):
+        self._postings = {} # term -> array met postings, of één posting (int)
+        self._docs = [] # documentnummer -> Post of Comment (None = vervangen)
+        self._lengths = array.array('H') # documentnummer -> aantal termen
+        self._docnums = {} # post/comment id -> documentnummer
+        self._live = 0
+        self._total_length = 0
+
+    def rebuild(self, posts):
+        """Bouw de index opnieuw op, oudste document eerst."""
+        documents = []
+        for post in posts:
+            documents.append(post)
+            self._collect_comments(post.comments, documents)
+        documents.sort(key=lambda doc: doc.timestamp_us)
+        with self._lock:
+            self._reset()
+            for doc in documents:
+                self._add(doc, doc.content if isinstance(doc, Post) else doc.moderated_content)
+
+    def _collect_comments(self, comments, documents):
+        for comment in comments:
+            if comment.status == COMMENT_PUBLISHED:
+                documents.append(comment)
+            if comment.replies:
+                self._collect_comments(comment.replies, documents)
+
+    def add_post(self, post: Post):
+        with self._lock:
+            self._add(post, post.content)
+
+    def add_comment(self, comment: Comment):
+        """Indexeer een reactie zodra die gepubliceerd is (vervangt een eerdere versie)."""
+        if comment.status != COMMENT_PUBLISHED:
+            return
+        with self._lock:
+            self._add(comment, comment.moderated_content)
+
+    def _add(self, doc, text):
+        old = self._docnums.get(doc.id)
+        if old is not None:
+            self._docs[old] = None
+            self._live -= 1
+            self._total_length -= self._lengths[old]
+        counts = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        docnum = len(self._docs)
+        length = min(sum(counts.values()), 0xFFFF)
+        self._docs.append(doc)
+        self._lengths.append(length)
+        self._docnums[doc.id] = docnum
+        self._live += 1
+        self._total_length += length
+        postings_by_term = self._postings
+        for term, frequency in counts.items():
+            posting = docnum << FREQUENCY_BITS | (frequency if frequency < MAX_FREQUENCY else MAX_FREQUENCY)
+            postings = postings_by_term.get(term)
+            if postings is None:
+                postings_by_term[term] = posting # De meeste termen komen maar één keer voor
+            elif type(postings) is int:
+                postings_by_term[term] = array.array('I', (postings, posting))
+            else:
+                postings.append(posting)
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> SearchPage:
+        """Zoek documenten met alle termen uit `query`, best passende eerst.
+
+        `total` is het aantal gerangschikte treffers; `truncated` geeft aan
+        dat er meer (oudere) treffers waren dan `max_candidates`.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        with self._lock:
+            self.queries += 1
+            if not terms or not self._live:
+                return SearchPage([], 0, False)
+            postings = [self._postings.get(term) for term in terms]
+            if any(p is None for p in postings):
+                return SearchPage([], 0, False)
+            postings = [(p,) if type(p) is int else p for p in postings]
+            postings.sort(key=len) # Zeldzaamste term eerst: minste kandidaten
+            scored, truncated = self._rank(postings)
+            top = heapq.nlargest(offset + limit, scored) # Bij gelijke score: nieuwste eerst
+            hits = [self._docs[docnum] for _, docnum in top[offset:]]
+        return SearchPage(hits, len(scored), truncated)
+
+    def _rank(self, postings):
+        """BM25-score van de documenten met alle termen, van nieuw naar oud, als (score, documentnummer)."""
+        count = self._live
+        idfs = [math.log(1 + (count - len(p) + 0.5) / (len(p) + 0.5)) for p in postings]
+        norm = BM25_K1 * BM25_B / (self._total_length / count or 1.0)
+        base = BM25_K1 * (1 - BM25_B)
+        docs, lengths = self._docs, self._lengths
+        base_postings, others = postings[0], postings[1:]
+        bounds = [len(p) for p in others] # Zoeken gaat van achter naar voren: alles erna is al gehad
+        scored = []
+        for position in range(len(base_postings) - 1, -1, -1):
+            posting = base_postings[position]
+            docnum = posting >> FREQUENCY_BITS
+            if docs[docnum] is None:
+                continue
+            saturation = base + norm * lengths[docnum]
+            frequency = posting & MAX_FREQUENCY
+            score = idfs[0] * frequency * (BM25_K1 + 1) / (frequency + saturation)
+            for k, other in enumerate(others, 1):
+                found = bisect.bisect_left(other, docnum << FREQUENCY_BITS, 0, bounds[k - 1])
+                bounds[k - 1] = found
+                if found == len(other) or other[found] >> FREQUENCY_BITS != docnum:
+                    break
+                frequency = other[found] & MAX_FREQUENCY
+                score += idfs[k] * frequency * (BM25_K1 + 1) / (frequency + saturation)
+            else:
+                if len(scored) == self.max_candidates:
+                    return scored, True
+                scored.append((score, docnum))
+        return scored, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'documents': self._live,
+                'replaced': len(self._docs) - self._live,
+                'terms': len(self._postings),
+                'queries': self.queries,
+            }
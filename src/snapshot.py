@@ -0,0 +1,131 @@
+"""Binair snapshotformaat voor de journal-opslag.
+
+Opbouw van het bestand:
+
+    header   'DLNKSNAP' + versie, journal_segment, aantal users, aantal posts
+    record   users: [[id, username, password_hash], ...]
+    record   per post: [id, user_id, content, image_filename, image_variants, tijd, comments]
+
+Elk record is een uint32 lengte gevolgd door compacte JSON met lijsten op
+vaste posities (geen sleutelnamen per veld). Een comment is
+[id, user_id, original, moderated, tijd, status, replies], waarbij moderated
+null is als de tekst niet gewijzigd werd. Tijden zijn gehele microseconden.
+Lezen en schrijven gaat post voor post, zodat nooit de hele dataset tegelijk
+als tekst of dict in het geheugen staat.
+"""
+import json
+import struct
+
+from src.models import User, Post, Comment, COMMENT_PENDING, COMMENT_PUBLISHED, NO_REPLIES, intern_id
+
+SNAPSHOT_MAGIC = b'DLNKSNAP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIII') # magic, versie, journal_segment, users, posts
+RECORD_LENGTH = struct.Struct('<I')
+STATUS_CODES = (COMMENT_PUBLISHED, COMMENT_PENDING) # Status als index in deze tuple
+
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+
+def is_binary_snapshot(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def snapshot_segment(path: str):
+    """journal_segment uit de header van een binaire snapshot (None als die er niet is)."""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) != HEADER.size or not header.startswith(SNAPSHOT_MAGIC):
+        return None
+    return HEADER.unpack(header)[2]
+
+
+def encode_snapshot(f, journal_segment: int, users, posts):
+    """Schrijf een snapshot naar een open binair bestand, post voor post."""
+    f.write(HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, journal_segment, len(users), len(posts)))
+    _write_record(f, [[u.id, u.username, u.password_hash] for u in users])
+    for post in posts:
+        _write_record(f, _encode_post(post))
+
+
+def read_snapshot(path: str):
+    """Lees een snapshot. Geeft (journal_segment, users, posts) terug."""
+    with open(path, 'rb') as f:
+        magic, version, journal_segment, user_count, post_count = HEADER.unpack(_read_exact(f, HEADER.size))
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is geen Dialink snapshot")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Snapshotversie {version} wordt niet ondersteund")
+        users = [_decode_user(record) for record in json.loads(_read_record(f))]
+        # Post voor post: het ruwe record is weg zodra de post gehydrateerd is
+        posts = [_decode_post(json.loads(_read_record(f))) for _ in range(post_count)]
+    if len(users) != user_count:
+        raise ValueError(f"Onvolledige snapshot: {len(users)} van {user_count} gebruikers")
+    return journal_segment, users, posts
+
+
+def _write_record(f, value):
+    payload = _encoder.encode(value).encode('utf-8')
+    f.write(RECORD_LENGTH.pack(len(payload)))
+    f.write(payload)
+
+
+def _read_record(f) -> bytes:
+    (length,) = RECORD_LENGTH.unpack(_read_exact(f, RECORD_LENGTH.size))
+    return _read_exact(f, length)
+
+
+def _read_exact(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Onvolledige snapshot: bestand houdt midden in een record op")
+    return data
+
+
+def _encode_post(post: Post):
+    return [post.id, post.user_id, post.content, post.image_filename, post.image_variants,
+            post.timestamp_us, [_encode_comment(c) for c in post.comments]]
+
+
+def _encode_comment(comment: Comment):
+    moderated = comment.moderated_content
+    return [comment.id, comment.user_id, comment.original_content,
+            None if moderated == comment.original_content else moderated,
+            comment.timestamp_us, STATUS_CODES.index(comment.status),
+            [_encode_comment(r) for r in comment.replies]]
+
+
+def _decode_user(record):
+    user = User.__new__(User)
+    user.id = intern_id(record[0])
+    user.username = record[1]
+    user.password_hash = record[2]
+    return user
+
+
+def _decode_post(record):
+    post = Post.__new__(Post)
+    post.id, user_id, post.content, post.image_filename, post.image_variants, post.timestamp, comments = record
+    post.user_id = intern_id(user_id)
+    post.comments = []
+    for comment_record in comments:
+        post.add_comment(_decode_comment(comment_record, post.id))
+    return post
+
+
+def _decode_comment(record, post_id):
+    comment = Comment.__new__(Comment)
+    comment.id, user_id, comment.original_content, moderated, comment.timestamp, status, replies = record
+    comment.user_id = intern_id(user_id)
+    comment.moderated_content = comment.original_content if moderated is None else moderated
+    comment.status = STATUS_CODES[status]
+    comment.post_id = post_id
+    comment.parent_comment_id = None # add_reply vult de verwijzing naar de parent in
+    comment.replies = NO_REPLIES
+    for reply_record in replies:
+        comment.add_reply(_decode_comment(reply_record, post_id))
+    return comment
@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+import threading
+
+from src.index import username_key
+from src.models import User, Post, Comment
+from src.storage import DuplicateUsername, Storage
+
+CHANGE_LOG_KEEP = 10000 # Zoveel recente wijzigingen blijven bewaard voor workers die achterlopen
+CHANGE_LOG_PRUNE_EVERY = 1000 # Na zoveel eigen schrijfacties wordt de change log ingekort
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    username_key TEXT NOT NULL UNIQUE, -- casefold variant voor unieke, hoofdletterongevoelige namen
+    password_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    content TEXT NOT NULL,
+    image_filename TEXT,
+    image_variants TEXT NOT NULL DEFAULT '[]', -- JSON-lijst met breedtes
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_posts_timestamp ON posts (timestamp, id);
+CREATE TABLE IF NOT EXISTS comments (
+    id TEXT PRIMARY KEY,
+    post_id TEXT NOT NULL REFERENCES posts(id),
+    parent_comment_id TEXT REFERENCES comments(id),
+    user_id TEXT NOT NULL,
+    original_content TEXT NOT NULL,
+    moderated_content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'published'
+);
+CREATE INDEX IF NOT EXISTS idx_comments_post_timestamp ON comments (post_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_comments_parent ON comments (parent_comment_id);
+-- Elke mutatie ook als record (zelfde vorm als het journal), zodat andere workers de delta kunnen ophalen
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin INTEGER NOT NULL, -- pid van de schrijvende worker
+    op TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend (WAL mode) voor users, posts en comments.
+
+    Comments worden plat opgeslagen met post_id/parent_comment_id en bij het
+    laden weer tot een boom opgebouwd. Door WAL kunnen meerdere gunicorn
+    workers tegelijk lezen terwijl één van hen schrijft. Elke mutatie komt in
+    dezelfde transactie ook in de change_log; refresh() haalt daaruit de
+    wijzigingen van andere workers op (alles na het laatst geziene seq).
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout # Seconden wachten op een schrijflock van een andere worker
+        self._local = threading.local() # sqlite3 connecties zijn per thread
+        self._last_seq = 0 # Laatste change_log record dat dit proces verwerkt heeft
+        self._seq_lock = threading.Lock()
+        self._writes = 0
+        self._change_handler = None
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(comments)")}
+            if 'status' not in columns: # Database van vóór de moderatie-wachtrij
+                conn.execute("ALTER TABLE comments ADD COLUMN status TEXT NOT NULL DEFAULT 'published'")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(posts)")}
+            if 'image_variants' not in columns: # Database van vóór de afbeeldingsvarianten
+                conn.execute("ALTER TABLE posts ADD COLUMN image_variants TEXT NOT NULL DEFAULT '[]'")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # Veilig in WAL mode, veel sneller dan FULL
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def set_change_handler(self, handler):
+        self._change_handler = handler
+
+    # --- Laden ---
+
+    def load(self):
+        conn = self._connection()
+        conn.execute("BEGIN") # Eén leesmoment: data en change_log positie horen bij elkaar
+        try:
+            users, posts = self._load_tables(conn)
+            last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        finally:
+            conn.execute("COMMIT")
+        with self._seq_lock:
+            self._last_seq = last_seq
+        return users, posts
+
+    def _load_tables(self, conn):
+        users = [
+            User.from_dict({'id': row[0], 'username': row[1], 'password_hash': row[2]})
+            for row in conn.execute("SELECT id, username, password_hash FROM users")
+        ]
+        posts = []
+        posts_by_id = {}
+        for row in conn.execute("SELECT id, user_id, content, image_filename, timestamp, image_variants FROM posts ORDER BY timestamp, id"):
+            post = Post.from_dict({'id': row[0], 'user_id': row[1], 'content': row[2],
+                                   'image_filename': row[3], 'timestamp': row[4], 'image_variants': json.loads(row[5])})
+            posts.append(post)
+            posts_by_id[post.id] = post
+
+        # Comments komen in chronologische volgorde binnen, dus een parent is
+        # altijd al aangemaakt voordat zijn replies langskomen.
+        comments_by_id = {}
+        query = ("SELECT id, post_id, parent_comment_id, user_id, original_content, moderated_content, timestamp, status "
+                 "FROM comments ORDER BY post_id, timestamp, rowid")
+        for row in conn.execute(query):
+            comment = Comment.from_dict({'id': row[0], 'post_id': row[1], 'parent_comment_id': row[2], 'user_id': row[3],
+                                         'original_content': row[4], 'moderated_content': row[5], 'timestamp': row[6],
+                                         'status': row[7]})
+            comments_by_id[comment.id] = comment
+            parent = comments_by_id.get(comment.parent_comment_id)
+            if parent is not None:
+                parent.add_reply(comment)
+            elif comment.post_id in posts_by_id:
+                posts_by_id[comment.post_id].add_comment(comment)
+        return users, posts
+
+    # --- Wijzigingen van andere processen ---
+
+    def has_changes(self) -> bool:
+        # data_version verandert als een andere connectie iets commit; per thread bijgehouden,
+        # want elke thread heeft zijn eigen connectie
+        version = self._connection().execute("PRAGMA data_version").fetchone()[0]
+        if version == getattr(self._local, 'data_version', None):
+            return False
+        self._local.data_version = version
+        return True
+
+    def refresh(self) -> bool:
+        with self._seq_lock:
+            rows = self._connection().execute(
+                "SELECT seq, origin, op, data FROM change_log WHERE seq > ? ORDER BY seq", (self._last_seq,)).fetchall()
+            if rows and rows[0][0] > self._last_seq + 1:
+                return False # Tussenliggende records zijn al opgeruimd: volledig opnieuw laden
+            own_pid = os.getpid()
+            for seq, origin, op, data in rows:
+                if origin != own_pid and self._change_handler is not None:
+                    self._change_handler(op, json.loads(data))
+                self._last_seq = seq
+        return True
+
+    # --- Schrijven ---
+
+    def add_user(self, user: User):
+        try:
+            with self._connection() as conn:
+                conn.execute(*_user_insert(user, or_ignore=False))
+                self._log(conn, 'add_user', user.to_dict())
+        except sqlite3.IntegrityError:
+            raise DuplicateUsername(user.username)
+
+    def add_post(self, post: Post):
+        with self._connection() as conn:
+            conn.execute(*_post_insert(post))
+            self._log(conn, 'add_post', post.to_dict())
+
+    def add_comment(self, comment: Comment):
+        with self._connection() as conn:
+            conn.execute(*_comment_insert(comment))
+            self._log(conn, 'add_comment', comment.to_dict())
+
+    def update_user(self, user: User):
+        with self._connection() as conn:
+            conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (user.password_hash, user.id))
+            self._log(conn, 'update_user', {'id': user.id, 'password_hash': user.password_hash})
+
+    def update_post(self, post: Post):
+        with self._connection() as conn:
+            conn.execute("UPDATE posts SET image_variants = ? WHERE id = ?", (json.dumps(post.image_variants), post.id))
+            self._log(conn, 'update_post', {'id': post.id, 'image_variants': post.image_variants})
+
+    def update_comment(self, comment: Comment):
+        self.update_comments([comment])
+
+    def update_comments(self, comments):
+        with self._connection() as conn: # Eén transactie voor de hele batch
+            for comment in comments:
+                conn.execute("UPDATE comments SET moderated_content = ?, status = ? WHERE id = ?",
+                             (comment.moderated_content, comment.status, comment.id))
+                self._log(conn, 'update_comment', {'id': comment.id, 'moderated_content': comment.moderated_content,
+                                                   'status': comment.status})
+
+    def _log(self, conn, op, data):
+        """Schrijf de mutatie in de change_log (binnen de transactie van de mutatie zelf)."""
+        conn.execute("INSERT INTO change_log (origin, op, data) VALUES (?, ?, ?)",
+                     (os.getpid(), op, json.dumps(data, separators=(',', ':'), ensure_ascii=False)))
+        self._writes += 1
+        if self._writes % CHANGE_LOG_PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?", (CHANGE_LOG_KEEP,))
+
+    def import_data(self, users, posts):
+        """Importeer een volledige dataset in één transactie (idempotent)."""
+        with self._connection() as conn:
+            for user in users:
+                conn.execute(*_user_insert(user))
+            for post in posts:
+                conn.execute(*_post_insert(post))
+                for comment in _walk_comments(post.comments):
+                    conn.execute(*_comment_insert(comment))
+
+    def compact(self):
+        # Schrijf de WAL terug naar het hoofdbestand zodat die niet blijft groeien
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def _user_insert(user, or_ignore: bool = True):
+    return (("INSERT OR IGNORE" if or_ignore else "INSERT") + " INTO users (id, username, username_key, password_hash) VALUES (?, ?, ?, ?)",
+            (user.id, user.username, username_key(user.username), user.password_hash))
+
+
+def _post_insert(post):
+    return ("INSERT OR IGNORE INTO posts (id, user_id, content, image_filename, image_variants, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            (post.id, post.user_id, post.content, post.image_filename, json.dumps(post.image_variants), post.timestamp.isoformat()))
+
+
+def _comment_insert(comment):
+    return ("INSERT OR IGNORE INTO comments (id, post_id, parent_comment_id, user_id, original_content, moderated_content, timestamp, status) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (comment.id, comment.post_id, comment.parent_comment_id, comment.user_id,
+             comment.original_content, comment.moderated_content, comment.timestamp.isoformat(), comment.status))
+
+
+def _walk_comments(comments):
+    """Loop depth-first door een comment-boom; parents komen altijd vóór hun replies."""
+    for comment in comments:
+        yield comment
+        yield from _walk_comments(comment.replies)
@@ -0,0 +1,554 @@
+import contextlib
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows: geen file locks; draai dan met één worker-proces
+    fcntl = None
+
+from src.index import DataIndex
+from src.log import log_error, log_event, log_warning
+from src.metrics import SLOW_OPERATION_BUCKETS, registry
+from src.models import User, Post, Comment
+from src.snapshot import encode_snapshot, is_binary_snapshot, read_snapshot, snapshot_segment
+
+# Ook de compactie op de achtergrond schrijft snapshots, dus we meten hier en niet in save_data
+snapshot_write_seconds = registry.histogram('dialink_snapshot_write_seconds', 'Duur van het schrijven van een snapshot',
+                                            buckets=SLOW_OPERATION_BUCKETS)
+# Begin van een JSON-snapshot zoals _write_snapshot die schrijft
+JSON_SEGMENT_PREFIX = re.compile(rb'\{"journal_segment":(\d+),')
+
+
+class DuplicateUsername(Exception):
+    """Een andere worker heeft deze gebruikersnaam net geregistreerd."""
+
+
+class Storage:
+    """Interface voor persistente opslag van users, posts en comments.
+
+    De app houdt de data in het geheugen; een backend zorgt dat elke mutatie
+    duurzaam wordt vastgelegd en dat load() de volledige stand teruggeeft.
+
+    Met meerdere worker-processen deelt iedereen dezelfde opslag: refresh()
+    geeft de wijzigingen van andere processen door aan de change handler, zodat
+    elke worker zijn geheugen bijwerkt met alleen de delta.
+    """
+
+    def load(self):
+        """Geef (users, posts) terug, met comments als boom onder hun post."""
+        raise NotImplementedError
+
+    def add_user(self, user: User):
+        raise NotImplementedError
+
+    def add_post(self, post: Post):
+        raise NotImplementedError
+
+    def add_comment(self, comment: Comment):
+        raise NotImplementedError
+
+    def update_user(self, user: User):
+        """Leg een nieuwe wachtwoord-hash van een bestaande gebruiker vast."""
+        raise NotImplementedError
+
+    def update_post(self, post: Post):
+        """Leg de beschikbare afbeeldingsvarianten van een bestaande post vast."""
+        raise NotImplementedError
+
+    def update_comment(self, comment: Comment):
+        """Leg de gemodereerde tekst en status van een bestaande comment vast."""
+        raise NotImplementedError
+
+    def update_comments(self, comments):
+        """Leg meerdere bijgewerkte comments in één keer vast (batches van de her-moderatie)."""
+        for comment in comments:
+            self.update_comment(comment)
+
+    def import_data(self, users, posts):
+        """Schrijf een complete dataset weg (gebruikt door de migratietool)."""
+        for user in users:
+            self.add_user(user)
+        for post in posts:
+            self.add_post(post)
+
+    def compact(self):
+        """Optioneel: ruim interne logs op / schrijf een volledige snapshot."""
+
+    def set_state_provider(self, provider):
+        """Optioneel: backends die zelf snapshots maken hebben de actuele stand nodig."""
+
+    def set_change_handler(self, handler):
+        """Registreer handler(op, data) voor wijzigingen die een ander proces schreef."""
+
+    def has_changes(self) -> bool:
+        """Goedkope check of refresh() iets te doen zou kunnen hebben."""
+        return False
+
+    def refresh(self) -> bool:
+        """Verwerk wijzigingen van andere processen. False: we liepen te ver achter, load() opnieuw."""
+        return True
+
+    def exclusive(self):
+        """Context manager waarbinnen geen ander proces schrijft (check-then-write, bv. registratie)."""
+        return contextlib.nullcontext()
+
+
+def create_storage(backend: str, path: str, **options) -> Storage:
+    """Maak de storage backend die bij de configuratie hoort ('json' of 'sqlite')."""
+    if backend == 'json':
+        return JournalStorage(path, **options)
+    if backend == 'sqlite':
+        from src.sqlite_storage import SQLiteStorage # Alleen laden als de backend gebruikt wordt
+        return SQLiteStorage(path, **options)
+    raise ValueError(f"Onbekende storage backend: {backend}")
+
+
+class JournalStorage(Storage):
+    """Append-only opslag voor users, posts en comments.
+
+    Elke mutatie wordt als één compacte JSON-regel aan een journal-segment
+    toegevoegd (O(1) per schrijfactie). Periodiek wordt op de achtergrond een
+    volledige snapshot geschreven (atomisch via een tijdelijk bestand en
+    os.replace), waarna de verwerkte segmenten worden opgeruimd.
+    Bij het laden wordt de snapshot ingelezen en worden de journal-segmenten
+    opnieuw afgespeeld. Een half geschreven laatste regel (crash tijdens het
+    schrijven) wordt genegeerd en weggeknipt; de rest van de data blijft intact.
+
+    De snapshot is standaard binair (zie src/snapshot.py) en staat naast het
+    JSON-pad, bv. data.snapshot naast data.json. Een bestaande data.json wordt
+    nog gelezen; na de eerste binaire snapshot wordt die hernoemd naar .bak.
+
+    Meerdere processen (gunicorn workers) delen het journal. Schrijven,
+    roteren en opruimen gebeurt onder een file lock (`data.json.lock`); vóór
+    elke schrijfactie leest een proces eerst de records van de anderen in
+    (via de change handler), zodat het journal één volgorde heeft en een
+    snapshot nooit records van een andere worker mist. Elk proces onthoudt
+    tot waar het gelezen heeft, dus refresh() verwerkt alleen de delta.
+    """
+
+    def __init__(self, snapshot_path: str, compact_threshold: int = 500, fsync: bool = False,
+                 snapshot_format: str = 'binary'):
+        if snapshot_format not in ('binary', 'json'):
+            raise ValueError(f"Onbekend snapshotformaat: {snapshot_format}")
+        self.json_path = snapshot_path
+        self.binary_path = os.path.splitext(snapshot_path)[0] + '.snapshot'
+        self.snapshot_format = snapshot_format
+        self.snapshot_path = self.binary_path if snapshot_format == 'binary' else self.json_path
+        self.journal_prefix = snapshot_path + '.journal.'
+        self.compact_threshold = compact_threshold # Aantal records waarna we compacteren
+        self.fsync = fsync # True: elke record direct naar schijf forceren (trager, veiliger)
+        self._lock = _ProcessLock(snapshot_path + '.lock')
+        self._segment = 0 # Segment dat we lezen en waar nu naartoe geschreven wordt
+        self._offset = 0 # Aantal bytes van dat segment dat al verwerkt is
+        self._segment_records = 0 # Records sinds de laatste snapshot (van alle processen)
+        self._needs_reload = False
+        self._journal_file = None
+        self._compact_thread = None
+        self._state_provider = None # Callable die (users, posts) teruggeeft voor compactie
+        self._change_handler = None
+
+    def set_state_provider(self, provider):
+        """Registreer een functie die de actuele (users, posts) lijsten teruggeeft."""
+        self._state_provider = provider
+
+    def set_change_handler(self, handler):
+        self._change_handler = handler
+
+    def exclusive(self):
+        return self._lock
+
+    # --- Laden ---
+
+    def load(self):
+        """Laad snapshot en speel de journal-segmenten af. Geeft (users, posts) terug."""
+        with self._lock:
+            users, posts, start_segment = self._read_snapshot()
+            replay = ReplayState(users, posts)
+            # Oudere segmenten zijn al in de snapshot verwerkt; de compactie ruimt ze op
+            # (niet hier: een andere worker kan er nog mee bezig zijn).
+            segments = [(number, path) for number, path in self._segments() if number >= start_segment]
+            replayed = 0
+            offset = 0
+            for _, path in segments:
+                count, offset = self._replay_segment(path, replay.apply)
+                replayed += count
+            self._close_journal()
+            self._segment = segments[-1][0] if segments else start_segment
+            self._offset = offset
+            self._segment_records = replayed
+            self._needs_reload = False
+        return users, posts
+
+    def _read_snapshot(self):
+        path = self._existing_snapshot()
+        if path is None:
+            return [], [], 0
+        if is_binary_snapshot(path):
+            start_segment, users, posts = read_snapshot(path)
+            return users, posts, start_segment
+        # JSON-snapshot: het oude formaat, of bewust gekozen met snapshot_format='json'
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        users = [User.from_dict(u_data) for u_data in data.get('users', [])]
+        posts = [Post.from_dict(p_data) for p_data in data.get('posts', [])]
+        return users, posts, data.get('journal_segment', 0)
+
+    def _existing_snapshot(self):
+        """De snapshot om te laden: bij voorkeur die in het ingestelde formaat."""
+        for path in (self.snapshot_path, self._other_snapshot_path()):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _current_snapshot_segment(self):
+        """journal_segment van de snapshot die er nu staat (None als er geen is)."""
+        if self.snapshot_format == 'binary':
+            return snapshot_segment(self.snapshot_path)
+        return _json_snapshot_segment(self.snapshot_path)
+
+    def _other_snapshot_path(self):
+        return self.json_path if self.snapshot_path == self.binary_path else self.binary_path
+
+    def _segment_path(self, number):
+        return f"{self.journal_prefix}{number}"
+
+    def _segments(self):
+        """Geef alle journal-segmenten als gesorteerde lijst van (nummer, pad)."""
+        pattern = re.compile(re.escape(self.journal_prefix) + r'(\d+)$')
+        found = []
+        for path in glob.glob(glob.escape(self.journal_prefix) + '*'):
+            match = pattern.match(path)
+            if match:
+                found.append((int(match.group(1)), path))
+        return sorted(found)
+
+    def _replay_segment(self, path, apply, offset: int = 0):
+        """Speel records af vanaf `offset` (aanroepen met lock). Geeft (aantal, nieuwe offset)."""
+        count = 0
+        good_offset = offset
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for raw_line in f:
+                if not raw_line.endswith(b'\n'):
+                    break # Afgebroken regel (crash midden in een schrijfactie)
+                try:
+                    record = json.loads(raw_line)
+                except ValueError:
+                    break
+                apply(record['op'], record['data'])
+                good_offset += len(raw_line)
+                count += 1
+        if good_offset < os.path.getsize(path):
+            # Schrijvers houden de lock vast, dus dit is een restant van een crash
+            log_warning('journal_tail_truncated', path=path, offset=good_offset)
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+        return count, good_offset
+
+    # --- Wijzigingen van andere processen ---
+
+    def has_changes(self) -> bool:
+        # Twee stat-aanroepen: is ons segment gegroeid, of is er al een volgend segment?
+        try:
+            size = os.path.getsize(self._segment_path(self._segment))
+        except FileNotFoundError:
+            size = 0
+        return size != self._offset or os.path.exists(self._segment_path(self._segment + 1))
+
+    def refresh(self) -> bool:
+        if not self.has_changes():
+            return not self._needs_reload
+        with self._lock:
+            self._catch_up()
+            return not self._needs_reload
+
+    def _catch_up(self):
+        """Lees records van andere processen tot het einde van het journal (aanroepen met lock)."""
+        while True:
+            path = self._segment_path(self._segment)
+            next_exists = os.path.exists(self._segment_path(self._segment + 1))
+            if os.path.exists(path):
+                count, self._offset = self._replay_segment(path, self._apply_change, self._offset)
+                self._segment_records += count
+                next_exists = next_exists or os.path.exists(self._segment_path(self._segment + 1))
+            elif self._offset > 0 or next_exists:
+                # Ons segment is al opgeruimd: we liepen meer dan een compactie achter
+                self._needs_reload = True
+                self._skip_to_last_segment()
+                return
+            if not next_exists:
+                return
+            self._close_journal() # Een ander proces heeft geroteerd
+            self._segment += 1
+            self._offset = 0
+            self._segment_records = 0
+
+    def _skip_to_last_segment(self):
+        segments = self._segments()
+        self._close_journal()
+        if segments:
+            self._segment, path = segments[-1]
+            self._offset = os.path.getsize(path)
+
+    def _apply_change(self, op, data):
+        if self._change_handler is not None:
+            self._change_handler(op, data)
+
+    # --- Schrijven ---
+
+    def add_user(self, user: User):
+        self._append('add_user', user.to_dict())
+
+    def add_post(self, post: Post):
+        self._append('add_post', post.to_dict())
+
+    def add_comment(self, comment: Comment):
+        self._append('add_comment', comment.to_dict())
+
+    def update_user(self, user: User):
+        self._append('update_user', {'id': user.id, 'password_hash': user.password_hash})
+
+    def update_post(self, post: Post):
+        self._append('update_post', {'id': post.id, 'image_variants': post.image_variants})
+
+    def update_comment(self, comment: Comment):
+        self.update_comments([comment])
+
+    def update_comments(self, comments):
+        self._append_records([('update_comment', {'id': comment.id, 'moderated_content': comment.moderated_content,
+                                                  'status': comment.status}) for comment in comments])
+
+    def import_data(self, users, posts):
+        # Post.to_dict bevat de volledige comment-boom, dus één snapshot volstaat
+        with self._lock:
+            self._close_journal()
+            self._segment += 1
+            self._offset = 0
+            segment = self._segment
+        self._write_snapshot(segment, list(users), list(posts))
+
+    def _append(self, op, data):
+        self._append_records([(op, data)])
+
+    def _append_records(self, records):
+        """Voeg records toe met één keer de lock en één write (één regel per record)."""
+        lines = b''.join((json.dumps({'op': op, 'data': data}, separators=(',', ':'), ensure_ascii=False) + '\n').encode('utf-8')
+                         for op, data in records)
+        with self._lock:
+            self._catch_up() # Eerst de records van andere workers, dan pas de onze
+            f = self._journal()
+            f.write(lines)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self._offset += len(lines)
+            self._segment_records += len(records)
+            if self._segment_records >= self.compact_threshold:
+                self._start_background_compaction()
+
+    def _journal(self):
+        if self._journal_file is None:
+            self._journal_file = open(self._segment_path(self._segment), 'ab')
+        return self._journal_file
+
+    def _close_journal(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    # --- Compactie ---
+
+    def _rotate(self):
+        """Start een nieuw segment en leg de huidige stand vast (aanroepen met lock, bijgewerkt)."""
+        users, posts = self._state_provider() if self._state_provider else ([], [])
+        self._close_journal()
+        self._segment += 1
+        # Het nieuwe segment meteen aanmaken: andere workers zien zo dat er geroteerd is
+        open(self._segment_path(self._segment), 'ab').close()
+        self._offset = 0
+        self._segment_records = 0
+        # Alleen de lijsten kopiëren; serialiseren gebeurt buiten de lock.
+        # Mutaties die tijdens het serialiseren binnenkomen staan ook in het
+        # nieuwe segment en worden bij het afspelen idempotent toegepast.
+        return self._segment, list(users), list(posts)
+
+    def _start_background_compaction(self):
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        if self._state_provider is None or self._needs_reload:
+            return # Zonder (actuele) stand in het geheugen kunnen we geen snapshot maken
+        snapshot = self._rotate()
+        self._compact_thread = threading.Thread(target=self._write_snapshot, args=snapshot, daemon=True)
+        self._compact_thread.start()
+
+    def compact(self):
+        """Schrijf direct (synchroon) een volledige snapshot en ruim het journal op."""
+        if self._state_provider is None:
+            return
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+        with self._lock:
+            self._catch_up()
+            if self._needs_reload:
+                return
+            snapshot = self._rotate()
+        self._write_snapshot(*snapshot)
+
+    def _write_snapshot(self, segment, users, posts):
+        started = time.perf_counter()
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp" # Per proces: workers kunnen tegelijk compacteren
+        try:
+            if self.snapshot_format == 'binary':
+                with open(tmp_path, 'wb') as f:
+                    encode_snapshot(f, segment, users, posts)
+                    f.flush()
+                    os.fsync(f.fileno())
+            else:
+                data_to_save = {
+                    'journal_segment': segment,
+                    'users': [u.to_dict() for u in users],
+                    'posts': [p.to_dict() for p in posts]
+                }
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data_to_save, f, separators=(',', ':'), ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+            with self._lock:
+                current = self._current_snapshot_segment()
+                if current is not None and current > segment:
+                    _remove_quietly(tmp_path) # Een andere worker schreef al een nieuwere snapshot
+                    return
+                os.replace(tmp_path, self.snapshot_path) # Atomisch: oude snapshot blijft geldig tot hier
+                # Een snapshot in het andere formaat is nu verouderd; bewaren als backup
+                other_path = self._other_snapshot_path()
+                if os.path.exists(other_path):
+                    os.replace(other_path, other_path + '.bak')
+                # Eén segment extra bewaren voor workers die nog niet alles gelezen hebben
+                for number, path in self._segments():
+                    if number < segment - 1:
+                        _remove_quietly(path)
+            elapsed = time.perf_counter() - started
+            snapshot_write_seconds.observe(elapsed)
+            log_event('snapshot_written', path=self.snapshot_path, segment=segment, seconds=round(elapsed, 3))
+        except Exception as e:
+            _remove_quietly(tmp_path)
+            log_error('snapshot_failed', error=str(e))
+
+
+class _ProcessLock:
+    """Re-entrant lock tussen threads én processen (flock op een lock-bestand)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self._pid = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            if self._pid != os.getpid():
+                # Na een fork een eigen open bestand: flock geldt per open bestand, niet per proces
+                self._file = open(self.path, 'a')
+                self._pid = os.getpid()
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+class ReplayState:
+    """Past opgeslagen wijzigingen idempotent toe op users, posts en hun index.
+
+    Gebruikt bij het afspelen van het journal en door de app voor wijzigingen
+    van andere workers (met de index van de app zelf). apply() geeft het id
+    van de post terug waarvan de inhoud veranderde, anders None.
+    """
+
+    def __init__(self, users, posts, index: DataIndex = None):
+        self.users = users
+        self.posts = posts
+        if index is None:
+            index = DataIndex()
+            index.rebuild(users, posts)
+        self.index = index
+
+    def apply(self, op, data):
+        index = self.index
+        if op == 'add_user':
+            if index.user(data['id']) is None:
+                user = User.from_dict(data)
+                self.users.append(user)
+                index.add_user(user)
+        elif op == 'add_post':
+            if index.post(data['id']) is None:
+                post = Post.from_dict(data)
+                self.posts.append(post)
+                index.add_post(post)
+                return post.id
+        elif op == 'add_comment':
+            if index.comment(data['id']) is not None:
+                return None
+            post = index.post(data['post_id'])
+            if post is None:
+                return None
+            comment = Comment.from_dict(data)
+            parent = index.comment(data.get('parent_comment_id'))
+            if parent is not None:
+                parent.add_reply(comment)
+            else:
+                post.add_comment(comment)
+            index.add_comment(comment)
+            return post.id
+        elif op == 'update_user':
+            user = index.user(data['id'])
+            if user is not None:
+                user.password_hash = data['password_hash']
+        elif op == 'update_post':
+            post = index.post(data['id'])
+            if post is not None:
+                post.image_variants = data['image_variants']
+                return post.id
+        elif op == 'update_comment':
+            comment = index.comment(data['id'])
+            if comment is not None:
+                comment.moderated_content = data['moderated_content']
+                comment.status = data['status']
+                return comment.post_id
+        else:
+            log_warning('journal_op_skipped', op=op)
+        return None
+
+
+def _json_snapshot_segment(path):
+    """journal_segment uit een JSON-snapshot; _write_snapshot zet die sleutel vooraan."""
+    try:
+        with open(path, 'rb') as f:
+            match = JSON_SEGMENT_PREFIX.match(f.read(64))
+            if match:
+                return int(match.group(1))
+            f.seek(0)
+            data = json.load(f) # Ouder bestand met een andere opmaak: volledig lezen
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        return None # Half geschreven of geen JSON: niet bruikbaar om mee te vergelijken
+    return data.get('journal_segment', 0) if isinstance(data, dict) else None
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass